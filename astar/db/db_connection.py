@@ -1,47 +1,46 @@
 import os
 import time
 import logging
-import psycopg
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely.wkb import loads
+from shapely import wkb
 from shapely.geometry import LineString
+from sklearn.neighbors import BallTree
 from dotenv import load_dotenv
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
 
 load_dotenv()
-db_connection = None
-
-
-def get_db_connection(retries=5, delay=5):
-    global db_connection
-    if db_connection is not None and not db_connection.closed:
-        return db_connection
-
-    for attempt in range(retries):
-        try:
-            db_connection = psycopg.connect(
-                dbname=os.getenv("POSTGRES_DB"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host=os.getenv("POSTGRES_HOST"),
-                port=os.getenv("POSTGRES_PORT", "5432"),
-                autocommit=True,
-                row_factory=dict_row
-            )
-            logging.info("✅ Connected to the database.")
-            return db_connection
-        except psycopg.OperationalError as e:
-            logging.warning(f"⚠ Attempt {attempt + 1}: {e}")
-            time.sleep(delay)
-
-    raise Exception("❌ Could not connect to the database after multiple attempts.")
+
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
+
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
 
 
 def load_from_db(query, params=None):
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
+        with db_conn() as conn, conn.cursor() as cursor:
             cursor.execute(query, params or ())
             return cursor.fetchall()
     except Exception as e:
@@ -54,12 +53,21 @@ def fetch_latest_locations():
     Return a list of tuples (client_id, lat, lon, updated_at) for clients
     with a location updated at least 2 seconds ago.
     """
+    # Walk the small session table and do one backward index probe per client
+    # instead of sorting every geodata row (uses geodata_client_updated_idx).
     query = """
-    SELECT DISTINCT ON (client_id) client_id, lat, lon, speed, updated_at
-    FROM geodata
-    WHERE updated_at <= NOW() - INTERVAL '2 seconds'
-      AND timestamp <= NOW() + INTERVAL '5 minutes'
-    ORDER BY client_id, updated_at DESC
+    SELECT c.client_id, g.lat, g.lon, g.speed, g.updated_at
+    FROM (SELECT DISTINCT client_id FROM mqtt_sessions) c
+    CROSS JOIN LATERAL (
+        SELECT lat, lon, speed, updated_at
+        FROM geodata
+        WHERE client_id = c.client_id
+          AND updated_at <= NOW() - INTERVAL '2 seconds'
+          AND timestamp <= NOW() + INTERVAL '5 minutes'
+        ORDER BY updated_at DESC
+        LIMIT 1
+    ) g
+    ORDER BY c.client_id
     """
     results = load_from_db(query)
     if not results:
@@ -68,115 +76,158 @@ def fetch_latest_locations():
     return [(row["client_id"], row["lat"], row["lon"], row["speed"], row["updated_at"]) for row in results]
 
 
-def fetch_next_predicted_poi(client_id):
-    query = """
-        SELECT
-            lat,
-            lon,
-            predicted_visit_time AS timestamp,
-            ST_AsBinary(geom) AS geom
-        FROM view_combined_pois
-        WHERE client_id = %s
-        ORDER BY
-            CASE
-                WHEN poi_type LIKE 'predicted_%%' THEN 1  -- predicted first
-                ELSE 0
-            END DESC,
-            poi_rank DESC,
-            COALESCE(predicted_visit_time, NOW()) DESC NULLS LAST,
-            created_at DESC
-        LIMIT 1;
-    """
-    result = load_from_db(query, (client_id,))
-    if not result:
-        return gpd.GeoDataFrame(columns=["lat", "lon", "timestamp", "geom"])
-
-    df = pd.DataFrame(result)
-    df["geom"] = df["geom"].apply(lambda x: loads(x) if x else None)
-    return gpd.GeoDataFrame(df, geometry="geom", crs="EPSG:4326")
+# Static GTFS stops held in memory so nearest-stop lookups skip the database
+STOP_INDEX_TTL_SEC = int(os.getenv("ASTAR_STOP_INDEX_TTL_SEC", "600"))
+_stop_index = {"loaded_at": 0.0, "stops": None, "tree": None}
 
 
-def fetch_fallback_stop_point(current_lat, current_lon):
+def get_stop_index():
     """
-    Fetch the nearest stop from gtfs_stops table.
+    Return the cached (stops, BallTree) pair, reloading gtfs_stops once the TTL expires.
+    A stale index is kept if a reload comes back empty.
     """
+    now = time.monotonic()
+    if _stop_index["tree"] is not None and now - _stop_index["loaded_at"] < STOP_INDEX_TTL_SEC:
+        return _stop_index["stops"], _stop_index["tree"]
+
     query = """
     SELECT stop_id, stop_lat, stop_lon
     FROM gtfs_stops
     WHERE location_type = 0
-    ORDER BY ST_SetSRID(ST_MakePoint(stop_lon, stop_lat), 4326)
-             <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-    LIMIT 1;
+      AND stop_lat IS NOT NULL
+      AND stop_lon IS NOT NULL;
     """
-    result = load_from_db(query, (current_lon, current_lat))
-    if not result:
-        logging.warning("⚠ No GTFS stops found for fallback.")
-        return None
-    return result[0]["stop_lat"], result[0]["stop_lon"], result[0]["stop_id"]
+    results = load_from_db(query)
+    if results:
+        stops = [(row["stop_lat"], row["stop_lon"], row["stop_id"]) for row in results]
+        coords = np.radians([[stop_lat, stop_lon] for stop_lat, stop_lon, _ in stops])
+        _stop_index.update(loaded_at=now, stops=stops, tree=BallTree(coords, metric="haversine"))
+        logging.info(f"✅ Loaded {len(stops)} GTFS stops into the nearest-stop index.")
+    elif _stop_index["tree"] is None:
+        return None, None
 
+    return _stop_index["stops"], _stop_index["tree"]
 
-def fetch_existing_poi_targets(client_id, lat, lon, tolerance_meters=30):
-    """
-    Attempts to find a matching POI ID from the 'pois' table near the predicted location.
-    Returns {'poi_id': ...} if found, else None.
+
+def nearest_stops(lats, lons):
     """
-    query = """
-    SELECT poi_id
-    FROM pois
-    WHERE client_id = %s
-      AND ST_DWithin(
-            geom,
-            ST_SetSRID(ST_MakePoint(%s, %s), 4326),
-            %s
-      )
-    ORDER BY ST_Distance(
-        geom,
-        ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-    )
-    LIMIT 1;
+    Nearest GTFS stop for each (lat, lon) pair, in one vectorized BallTree query.
+    Returns a list of (stop_lat, stop_lon, stop_id), or [] when no stops are loaded.
     """
-    result = load_from_db(query, (client_id, lon, lat, tolerance_meters, lon, lat))
-    if result:
-        return {"poi_id": result[0]["poi_id"]}
-    return None
+    stops, tree = get_stop_index()
+    if tree is None or not len(lats):
+        return []
 
+    _, idx = tree.query(np.radians(np.column_stack([lats, lons]).astype(np.float64)), k=1)
+    return [stops[i] for i in idx[:, 0]]
 
-def fetch_closest_stop_id(destination_coords):
+
+def fetch_routing_contexts(clients, tolerance_meters=30):
     """
-    Find the closest GTFS stop to the given (lat, lon) and return its stop_id.
+    Resolve every routing input for a batch of clients in a single round-trip.
+    POIs come from the database; nearest stops come from the in-process stop index.
+
+    :param clients: iterable of (client_id, lat, lon, ...) tuples as returned by fetch_latest_locations()
+    Returns {client_id: row} where each row carries:
+      poi_lat, poi_lon, poi_id, poi_stop_id        (None when the client has no POI)
+      fallback_lat, fallback_lon, fallback_stop_id (None when no GTFS stop exists)
     """
+    client_ids, lats, lons = [], [], []
+    for client_id, lat, lon, *_ in clients:
+        client_ids.append(client_id)
+        lats.append(lat)
+        lons.append(lon)
+
+    if not client_ids:
+        return {}
+
     query = """
-    SELECT stop_id
-    FROM gtfs_stops
-    WHERE location_type = 0
-    ORDER BY ST_SetSRID(ST_MakePoint(stop_lon, stop_lat), 4326)
-             <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-    LIMIT 1;
+    WITH clients (client_id, lat, lon) AS (
+        SELECT * FROM unnest(%s::text[], %s::float8[], %s::float8[])
+    )
+    SELECT
+        c.client_id,
+        poi.lat AS poi_lat,
+        poi.lon AS poi_lon,
+        poi_match.poi_id
+    FROM clients c
+    LEFT JOIN LATERAL (
+        SELECT v.lat, v.lon
+        FROM mv_combined_pois v
+        WHERE v.client_id = c.client_id
+        ORDER BY
+            CASE
+                WHEN v.poi_type LIKE 'predicted_%%' THEN 1  -- predicted first
+                ELSE 0
+            END DESC,
+            v.poi_rank DESC,
+            COALESCE(v.predicted_visit_time, NOW()) DESC NULLS LAST,
+            v.created_at DESC
+        LIMIT 1
+    ) poi ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT p.poi_id
+        FROM pois p
+        WHERE poi.lat IS NOT NULL
+          AND p.client_id = c.client_id
+          AND ST_DWithin(
+                p.geom,
+                ST_SetSRID(ST_MakePoint(poi.lon, poi.lat), 4326),
+                %s
+          )
+        ORDER BY ST_Distance(
+            p.geom,
+            ST_SetSRID(ST_MakePoint(poi.lon, poi.lat), 4326)
+        )
+        LIMIT 1
+    ) poi_match ON TRUE;
     """
-    lat, lon = destination_coords
-    result = load_from_db(query, (lon, lat))
+    results = load_from_db(query, (client_ids, lats, lons, tolerance_meters))
+    if not results:
+        logging.warning("⚠ No routing context resolved for active clients.")
+        return {}
+
+    contexts = {row["client_id"]: row for row in results}
+
+    fallbacks = nearest_stops(lats, lons)
+    for client_id, (stop_lat, stop_lon, stop_id) in zip(client_ids, fallbacks):
+        contexts[client_id].update(fallback_lat=stop_lat, fallback_lon=stop_lon, fallback_stop_id=stop_id)
+
+    with_poi = [row for row in contexts.values() if row["poi_lat"] is not None]
+    poi_stops = nearest_stops([row["poi_lat"] for row in with_poi], [row["poi_lon"] for row in with_poi])
+    for row, stop in zip(with_poi, poi_stops):
+        row["poi_stop_id"] = stop[2]
+
+    return contexts
 
-    if not result:
-        logging.warning(f"⚠ No stop_id found near POI at ({lat}, {lon})")
-        return None
 
-    return result[0]["stop_id"]
+ASTAR_ROUTE_INSERT = """
+INSERT INTO astar_routes (
+    client_id, stop_id, target_type, parent_station, poi_id,
+    origin_lat, origin_lon,
+    destination_lat, destination_lon, path, distance,
+    efficiency_score, decision_context, predicted_eta
+)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, ST_GeomFromEWKB(%s), %s, %s, %s, %s)
+ON CONFLICT DO NOTHING;
+"""
 
 
-def save_astar_route(client_id, stop_id, target_type, parent_station, poi_id,
-                     origin_coords, destination_coords, path_gdf,
-                     speed, decision_context="initial_prediction", efficiency_score=None):
+def build_astar_route_row(client_id, stop_id, target_type, parent_station, poi_id,
+                          origin_coords, destination_coords, path_gdf,
+                          speed, decision_context="initial_prediction", efficiency_score=None):
     """
-    Save the A* route to the database using GTFS-based identifiers.
+    Build the astar_routes parameter tuple for one computed route.
+    Returns None when the path cannot be persisted.
     """
     if path_gdf.empty or not isinstance(path_gdf, pd.DataFrame):
         logging.warning("⚠ Cannot save A* route: no path data.")
-        return
+        return None
 
     coords = path_gdf.geometry.to_list()
     if len(coords) < 2:
         logging.warning(f"⚠ Not enough points to form LineString for client {client_id}. Skipping route save.")
-        return
+        return None
 
     path = LineString(coords)
     distance = path_gdf["distance"].sum()
@@ -185,40 +236,38 @@ def save_astar_route(client_id, stop_id, target_type, parent_station, poi_id,
         predicted_eta = pd.Timestamp.utcnow() + pd.to_timedelta(distance / speed, unit="s")
     except Exception as e:
         logging.error(f"❌ Failed to calculate predicted_eta for client {client_id}: {e}")
-        return
+        return None
 
-    query = """
-    INSERT INTO astar_routes (
-        client_id, stop_id, target_type, parent_station, poi_id,
-        origin_lat, origin_lon,
-        destination_lat, destination_lon, path, distance,
-        efficiency_score, decision_context, predicted_eta
+    return (
+        client_id,
+        stop_id,
+        target_type,
+        parent_station,
+        poi_id,
+        origin_coords[0],
+        origin_coords[1],
+        destination_coords[0],
+        destination_coords[1],
+        wkb.dumps(path, srid=4326),  # binary EWKB, no text parse on the server
+        distance,
+        efficiency_score,
+        decision_context,
+        predicted_eta.to_pydatetime()
     )
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, ST_GeomFromText(%s, 4326), %s, %s, %s, %s)
-    ON CONFLICT DO NOTHING;
+
+
+def save_astar_routes(rows):
     """
+    Save a cycle's worth of A* routes in one batch.
+    psycopg pipelines executemany(), so all inserts share a single round-trip.
+    """
+    rows = [row for row in rows if row is not None]
+    if not rows:
+        return
 
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(query, (
-                client_id,
-                stop_id,
-                target_type,
-                parent_station,
-                poi_id,
-                origin_coords[0],
-                origin_coords[1],
-                destination_coords[0],
-                destination_coords[1],
-                path.wkt,
-                distance,
-                efficiency_score,
-                decision_context,
-                predicted_eta.to_pydatetime()
-            ))
-            logging.info(
-                f"✅ Saved A* route for {client_id} (stop_id={stop_id}, poi_id={poi_id}, ETA={predicted_eta})"
-            )
+        with db_conn() as conn, conn.cursor() as cursor:
+            cursor.executemany(ASTAR_ROUTE_INSERT, rows)
+        logging.info(f"✅ Saved {len(rows)} A* route(s).")
     except Exception as e:
-        logging.error(f"❌ Failed to save A* route for {client_id}: {e}")
+        logging.error(f"❌ Failed to save A* routes: {e}")
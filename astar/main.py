@@ -1,22 +1,68 @@
+import os
 import logging
 import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from db.db_connection import (
     fetch_latest_locations,
-    fetch_next_predicted_poi,
-    fetch_fallback_stop_point,
-    fetch_closest_stop_id,
-    save_astar_route,
-    fetch_existing_poi_targets
+    fetch_routing_contexts,
+    build_astar_route_row,
+    save_astar_routes,
 )
 from pathfinder import pathfinder
 
 logging.basicConfig(level=logging.INFO)
 
+# Worker processes keep their own tile-graph LRU warm across cycles (cold tiles come from the on-disk cache)
+ASTAR_WORKERS = int(os.getenv("ASTAR_WORKERS", str(os.cpu_count() or 1)))
+
+
+def route_one(job):
+    """
+    Compute one client → target route in a worker process.
+    Returns the astar_routes row, or None when no path was found.
+    """
+    client_id, lat, lon, speed, updated_at, target = job
+    path_gdf = pathfinder(
+        client_id=client_id,
+        goal_lat=target["goal_lat"],
+        goal_lon=target["goal_lon"],
+        latest_location=(lat, lon, speed, updated_at)
+    )
+
+    if path_gdf is None or path_gdf.empty:
+        return None
+
+    efficiency_score = path_gdf["distance"].sum()
+    avg_speed = speed if speed and speed > 0 else 1.4
+    return build_astar_route_row(
+        client_id=client_id,
+        stop_id=target.get("stop_id"),
+        target_type=target["target_type"],
+        parent_station=target.get("parent_station"),
+        poi_id=target.get("poi_id"),
+        origin_coords=(lat, lon),
+        destination_coords=(target["goal_lat"], target["goal_lon"]),
+        path_gdf=path_gdf,
+        speed=avg_speed,
+        decision_context=target["decision_context"],
+        efficiency_score=efficiency_score
+    )
+
 
 def main():
     logging.info("🚀 A* Module started.")
     time.sleep(60)  # Grace delay for DB, MQTT, etc.
 
+    while True:
+        try:
+            with ProcessPoolExecutor(max_workers=ASTAR_WORKERS) as pool:
+                run_loop(pool)
+        except BrokenProcessPool as e:
+            logging.error(f"❌ A* worker pool died, restarting it: {e}")
+
+
+def run_loop(pool):
     while True:
         try:
             clients_with_locations = fetch_latest_locations()
@@ -25,70 +71,51 @@ def main():
                 time.sleep(10)
                 continue
 
+            # One set-based query resolves POI, POI stop and fallback stop for every client
+            contexts = fetch_routing_contexts(clients_with_locations)
+            routing_jobs = []
+
             for client_id, lat, lon, speed, updated_at in clients_with_locations:
-                latest_location = (lat, lon, speed, updated_at)
+                context = contexts.get(client_id) or {}
                 routing_targets = []
 
                 # 1. Route to predicted POI
-                poi_df = fetch_next_predicted_poi(client_id)
-                if poi_df is not None and not poi_df.empty:
-                    poi_lat, poi_lon = poi_df.iloc[0]["lat"], poi_df.iloc[0]["lon"]
-                    matching_poi = fetch_existing_poi_targets(client_id, poi_lat, poi_lon)
-                    stop_id = fetch_closest_stop_id((poi_lat, poi_lon))  # GTFS-native
-
+                if context.get("poi_lat") is not None and context.get("poi_lon") is not None:
                     routing_targets.append({
-                        "goal_lat": poi_lat,
-                        "goal_lon": poi_lon,
+                        "goal_lat": context["poi_lat"],
+                        "goal_lon": context["poi_lon"],
                         "target_type": "poi",
-                        "stop_id": stop_id,
+                        "stop_id": context.get("poi_stop_id"),  # GTFS-native
                         "parent_station": None,  # could be fetched if needed later
-                        "poi_id": matching_poi.get("poi_id") if matching_poi else None,
+                        "poi_id": context.get("poi_id"),
                         "decision_context": "routed_to_poi"
                     })
 
                 # 2. Fallback to the closest stop point
-                fallback = fetch_fallback_stop_point(lat, lon)
-                if fallback:
-                    fallback_lat, fallback_lon, stop_id = fallback
+                if context.get("fallback_stop_id") is not None:
                     routing_targets.append({
-                        "goal_lat": fallback_lat,
-                        "goal_lon": fallback_lon,
+                        "goal_lat": context["fallback_lat"],
+                        "goal_lon": context["fallback_lon"],
                         "target_type": "stop_point",
-                        "stop_id": stop_id,
+                        "stop_id": context["fallback_stop_id"],
                         "parent_station": None,
                         "poi_id": None,
                         "decision_context": "fallback_stop_point"
                     })
 
-                # 3. Process each routing target
-                for target in routing_targets:
-                    path_gdf = pathfinder(
-                        client_id=client_id,
-                        goal_lat=target["goal_lat"],
-                        goal_lon=target["goal_lon"],
-                        latest_location=latest_location
-                    )
-
-                    if path_gdf is not None and not path_gdf.empty:
-                        efficiency_score = path_gdf["distance"].sum()
-                        avg_speed = speed if speed and speed > 0 else 1.4
-                        save_astar_route(
-                            client_id=client_id,
-                            stop_id=target.get("stop_id"),
-                            target_type=target["target_type"],
-                            parent_station=target.get("parent_station"),
-                            poi_id=target.get("poi_id"),
-                            origin_coords=(lat, lon),
-                            destination_coords=(target["goal_lat"], target["goal_lon"]),
-                            path_gdf=path_gdf,
-                            speed=avg_speed,
-                            decision_context=target["decision_context"],
-                            efficiency_score=efficiency_score
-                        )
+                routing_jobs.extend((client_id, lat, lon, speed, updated_at, target) for target in routing_targets)
+
+            # 3. Route every client/target pair in parallel across worker processes
+            route_rows = list(pool.map(route_one, routing_jobs))
+
+            # Flush the whole cycle in one pipelined batch
+            save_astar_routes(route_rows)
 
             logging.info("✅ A* cycle complete. Sleeping 10s...")
             time.sleep(10)
 
+        except BrokenProcessPool:
+            raise
         except Exception as e:
             logging.critical(f"💥 A* module crash: {e}", exc_info=True)
             time.sleep(30)
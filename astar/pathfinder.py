@@ -1,9 +1,14 @@
 import os
-import heapq
+import math
+import pickle
+import tempfile
 import logging
+import numpy as np
+from numba import njit
 from geopandas import GeoDataFrame
-from geopy.distance import geodesic
 from shapely.geometry import Point
+from sklearn.neighbors import BallTree
+from functools import lru_cache
 from osmnx.graph import graph_from_bbox
 import osmnx as ox
 
@@ -11,67 +16,159 @@ ox.settings.use_cache = True
 ox.settings.cache_folder = "/app/osm_cache"
 ox.settings.timeout = 300
 
+# Road graphs are cached per snapped bbox tile, in memory (LRU) and on disk
+TILE_DEGREES = float(os.getenv("ASTAR_TILE_DEGREES", "0.02"))
+GRAPH_CACHE_SIZE = int(os.getenv("ASTAR_GRAPH_CACHE_SIZE", "128"))
+TILE_CACHE_FOLDER = os.path.join(ox.settings.cache_folder, "tiles")
+
 os.makedirs(ox.settings.cache_folder, exist_ok=True)
+os.makedirs(TILE_CACHE_FOLDER, exist_ok=True)
 logging.basicConfig(level=logging.INFO)
 
 
-def a_star(start, goal, graph):
-    open_list = []
-    heapq.heappush(open_list, (0, start))
-    came_from = {}
-    g_score = {node: float("inf") for node in graph.nodes}
-    g_score[start] = 0
-    f_score = {node: float("inf") for node in graph.nodes}
-    f_score[start] = heuristic(start, goal, graph)
-
-    while open_list:
-        _, current = heapq.heappop(open_list)
-        if current == goal:
-            return reconstruct_path(came_from, current)
-
-        for neighbor in graph.neighbors(current):
-            edge_length = graph.edges[current, neighbor, 0].get(
-                "length", calculate_edge_length(graph, current, neighbor)
-            )
-            tentative_g_score = g_score[current] + edge_length
-            if tentative_g_score < g_score[neighbor]:
-                came_from[neighbor] = current
-                g_score[neighbor] = tentative_g_score
-                f_score[neighbor] = g_score[neighbor] + heuristic(neighbor, goal, graph)
-                if neighbor not in [i[1] for i in open_list]:
-                    heapq.heappush(open_list, (f_score[neighbor], neighbor))
-
-    logging.warning("⚠ No valid path found.")
-    return None
-
-
-def heuristic(node, goal, graph):
-    try:
-        node_coords = (graph.nodes[node]["y"], graph.nodes[node]["x"])
-        goal_coords = (graph.nodes[goal]["y"], graph.nodes[goal]["x"])
-        return geodesic(node_coords, goal_coords).meters
-    except KeyError:
-        logging.error(f"❌ Invalid node: {node} or goal: {goal} in graph.")
-        return float("inf")
+EARTH_RADIUS_M = 6_371_009  # same mean radius OSMnx uses for edge lengths
 
 
-def calculate_edge_length(graph, node1, node2):
-    try:
-        coords_1 = (graph.nodes[node1]["y"], graph.nodes[node1]["x"])
-        coords_2 = (graph.nodes[node2]["y"], graph.nodes[node2]["x"])
-        return geodesic(coords_1, coords_2).meters
-    except KeyError:
-        logging.error(f"❌ Missing node coordinates for edge {node1}-{node2}.")
-        return float("inf")
+def node_coords(graph):
+    """
+    Node ids and their (lat, lon) in radians as NumPy arrays, built once per cached graph.
+    """
+    cached = graph.graph.get("node_coords")
+    if cached is None:
+        nodes = list(graph.nodes)
+        lat = np.radians(np.fromiter((graph.nodes[n]["y"] for n in nodes), dtype=np.float64, count=len(nodes)))
+        lon = np.radians(np.fromiter((graph.nodes[n]["x"] for n in nodes), dtype=np.float64, count=len(nodes)))
+        cached = graph.graph["node_coords"] = (nodes, lat, lon)
+    return cached
+
+
+def graph_csr(graph):
+    """
+    CSR adjacency for the graph (node index, indptr, indices, weights), built once per cached graph.
+    Row i lists the out-edges of node_coords(graph)[0][i]; weights are edge lengths in meters.
+    """
+    cached = graph.graph.get("csr")
+    if cached is None:
+        nodes, _, _ = node_coords(graph)
+        index = {node: i for i, node in enumerate(nodes)}
+        edges = np.array(
+            [(index[u], index[v], length) for u, v, length in graph.edges(data="length", default=np.inf)],
+            dtype=np.float64,
+        ).reshape(-1, 3)
+
+        tails = edges[:, 0].astype(np.int64)
+        order = np.argsort(tails, kind="stable")
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(tails, minlength=len(nodes)))
+        indices = edges[order, 1].astype(np.int64)
+        weights = edges[order, 2]
+        cached = graph.graph["csr"] = (index, indptr, indices, weights)
+    return cached
+
+
+@njit(cache=True)
+def _haversine_m(lat1, lon1, lat2, lon2):
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
 
 
-def reconstruct_path(came_from, current):
-    total_path = [current]
-    while current in came_from:
-        current = came_from[current]
-        total_path.append(current)
-    total_path.reverse()
-    return total_path
+@njit(cache=True)
+def _heap_push(heap_f, heap_n, size, f, node):
+    i = size
+    heap_f[i] = f
+    heap_n[i] = node
+    while i > 0:
+        parent = (i - 1) >> 1
+        if heap_f[parent] <= heap_f[i]:
+            break
+        heap_f[i], heap_f[parent] = heap_f[parent], heap_f[i]
+        heap_n[i], heap_n[parent] = heap_n[parent], heap_n[i]
+        i = parent
+    return size + 1
+
+
+@njit(cache=True)
+def _heap_pop(heap_f, heap_n, size):
+    node = heap_n[0]
+    size -= 1
+    heap_f[0] = heap_f[size]
+    heap_n[0] = heap_n[size]
+    i = 0
+    while True:
+        child = 2 * i + 1
+        if child >= size:
+            break
+        if child + 1 < size and heap_f[child + 1] < heap_f[child]:
+            child += 1
+        if heap_f[i] <= heap_f[child]:
+            break
+        heap_f[i], heap_f[child] = heap_f[child], heap_f[i]
+        heap_n[i], heap_n[child] = heap_n[child], heap_n[i]
+        i = child
+    return node, size
+
+
+@njit(cache=True)
+def astar_csr(indptr, indices, weights, lat, lon, src, dst):
+    """
+    A* over CSR arrays with a haversine heuristic and an array-backed binary heap.
+    Stale heap entries are skipped on pop. Returns (came_from, distance); distance is inf when dst is unreachable.
+    """
+    n = lat.shape[0]
+    g = np.full(n, np.inf)
+    came_from = np.full(n, -1, dtype=np.int64)
+    closed = np.zeros(n, dtype=np.bool_)
+
+    # Every node is expanded at most once, so at most one push per edge plus the source
+    heap_f = np.empty(indices.shape[0] + 1, dtype=np.float64)
+    heap_n = np.empty(indices.shape[0] + 1, dtype=np.int64)
+
+    g[src] = 0.0
+    size = _heap_push(heap_f, heap_n, 0, _haversine_m(lat[src], lon[src], lat[dst], lon[dst]), src)
+
+    while size > 0:
+        u, size = _heap_pop(heap_f, heap_n, size)
+        if closed[u]:
+            continue
+        if u == dst:
+            return came_from, g[dst]
+        closed[u] = True
+
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            if closed[v]:
+                continue
+            candidate = g[u] + weights[k]
+            if candidate < g[v]:
+                g[v] = candidate
+                came_from[v] = u
+                f = candidate + _haversine_m(lat[v], lon[v], lat[dst], lon[dst])
+                size = _heap_push(heap_f, heap_n, size, f, v)
+
+    return came_from, np.inf
+
+
+def a_star(start, goal, graph):
+    """
+    Shortest path start -> goal by edge length.
+    Returns (route, distance_m), or (None, None) when no path exists.
+    """
+    nodes, lat, lon = node_coords(graph)
+    index, indptr, indices, weights = graph_csr(graph)
+    if start not in index or goal not in index:
+        logging.warning("⚠ No valid path found.")
+        return None, None
+
+    src, dst = index[start], index[goal]
+    came_from, distance = astar_csr(indptr, indices, weights, lat, lon, src, dst)
+    if math.isinf(distance):
+        logging.warning("⚠ No valid path found.")
+        return None, None
+
+    path = [dst]
+    while path[-1] != src:
+        path.append(came_from[path[-1]])
+    return [nodes[i] for i in reversed(path)], float(distance)
 
 
 def compute_dynamic_bbox(points, buffer=0.01):
@@ -88,6 +185,68 @@ def compute_dynamic_bbox(points, buffer=0.01):
     return (west, south, east, north)
 
 
+def snap_bbox_to_tiles(bbox, tile=TILE_DEGREES):
+    """
+    Expand a (west, south, east, north) bbox outward to whole tiles so that
+    nearby requests share the same cache key.
+    """
+    west, south, east, north = bbox
+    return (
+        round(math.floor(west / tile) * tile, 6),
+        round(math.floor(south / tile) * tile, 6),
+        round(math.ceil(east / tile) * tile, 6),
+        round(math.ceil(north / tile) * tile, 6),
+    )
+
+
+@lru_cache(maxsize=GRAPH_CACHE_SIZE)
+def load_tile_graph(tile_key):
+    """
+    Return the road graph for a snapped bbox tile.
+    Served from memory, then from the on-disk pickle, and only then downloaded.
+    """
+    path = os.path.join(TILE_CACHE_FOLDER, "{:.6f}_{:.6f}_{:.6f}_{:.6f}.pkl".format(*tile_key))
+    if os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning(f"⚠ Corrupt tile cache {path}, rebuilding: {e}")
+
+    G = graph_from_bbox(bbox=tile_key, network_type="all", simplify=True)
+    G = ox.distance.add_edge_lengths(G)  # A* weights and route distance both read edge "length"
+
+    # Unique temp file per writer: worker processes missing on the same tile must not share one
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=TILE_CACHE_FOLDER, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"⚠ Could not persist tile cache {path}: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return G
+
+
+def nearest_node(graph, lat, lon):
+    """
+    Nearest graph node to (lat, lon). The BallTree is built once per cached
+    graph and kept on the graph object for every later lookup.
+    """
+    index = graph.graph.get("node_index")
+    if index is None:
+        nodes = np.array(list(graph.nodes))
+        coords = np.radians([[graph.nodes[n]["y"], graph.nodes[n]["x"]] for n in nodes])
+        index = graph.graph["node_index"] = (nodes, BallTree(coords, metric="haversine"))
+
+    nodes, tree = index
+    _, idx = tree.query(np.radians([[lat, lon]]), k=1)
+    return nodes[idx[0, 0]].item()
+
+
 def pathfinder(client_id, goal_lat, goal_lon, latest_location=None):
     if not latest_location:
         logging.error(f"❌ No start location for client_id {client_id}. Cannot compute path.")
@@ -99,20 +258,19 @@ def pathfinder(client_id, goal_lat, goal_lon, latest_location=None):
     try:
         points = [(start_lat, start_lon), (goal_lat, goal_lon)]
         bbox = compute_dynamic_bbox(points)
-        G = graph_from_bbox(bbox=bbox, network_type="all", simplify=True)
+        G = load_tile_graph(snap_bbox_to_tiles(bbox))
 
-        start_node = ox.distance.nearest_nodes(G, start_lon, start_lat)
-        goal_node = ox.distance.nearest_nodes(G, goal_lon, goal_lat)
+        start_node = nearest_node(G, start_lat, start_lon)
+        goal_node = nearest_node(G, goal_lat, goal_lon)
     except Exception as e:
         logging.error(f"❌ Error creating graph or finding nodes: {e}")
         return None
 
-    route = a_star(start_node, goal_node, G)
+    route, total_distance = a_star(start_node, goal_node, G)
     if not route:
         logging.warning(f"⚠ No valid route found for client_id {client_id}.")
         return None
 
-    total_distance = sum([calculate_edge_length(G, route[i], route[i + 1]) for i in range(len(route) - 1)])
     avg_speed = 1.4  # m/s
     total_duration = total_distance / avg_speed
 
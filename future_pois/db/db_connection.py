@@ -1,46 +1,43 @@
 import logging
-import time
 import os
 import pandas as pd
 import psycopg
 from psycopg.rows import dict_row
-from psycopg import sql
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-db_connection = None
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv('POSTGRES_DB'),
+        "user": os.getenv('POSTGRES_USER'),
+        "password": os.getenv('POSTGRES_PASSWORD'),
+        "host": os.getenv('POSTGRES_HOST'),
+        "port": os.getenv('POSTGRES_PORT', '5432'),
+        "autocommit": True,
+        "row_factory": dict_row,
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
 
 
-def get_db_connection(retries=5, delay=5):
-    global db_connection
-    if db_connection and not db_connection.closed:
-        return db_connection
-
-    for attempt in range(retries):
-        try:
-            db_connection = psycopg.connect(
-                dbname=os.getenv('POSTGRES_DB'),
-                user=os.getenv('POSTGRES_USER'),
-                password=os.getenv('POSTGRES_PASSWORD'),
-                host=os.getenv('POSTGRES_HOST'),
-                port=os.getenv('POSTGRES_PORT', '5432'),
-                autocommit=True,
-                row_factory=dict_row
-            )
-            logging.info("✅ Connected to PostgreSQL.")
-            return db_connection
-        except psycopg.OperationalError as e:
-            logging.warning(f"⚠ DB connection attempt {attempt + 1} failed: {e}")
-            time.sleep(delay)
-    raise Exception("❌ Could not connect to DB after retries.")
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
 
 
 def load_from_db(query, conditions=None):
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
+        with db_conn() as conn, conn.cursor() as cursor:
             cursor.execute(query, conditions if conditions else ())
             return cursor.fetchall()
     except psycopg.Error as e:
@@ -49,7 +46,7 @@ def load_from_db(query, conditions=None):
 
 
 def fetch_latest_trajectories():
-    query = "SELECT client_id FROM view_latest_client_trajectories;"
+    query = "SELECT DISTINCT client_id FROM mv_latest_client_trajectories;"
     result = load_from_db(query)
     if not result:
         logging.warning("⚠ No active clients found in geodata.")
@@ -57,32 +54,43 @@ def fetch_latest_trajectories():
     return [row["client_id"] for row in result]
 
 
-def save_to_db(table, data):
-    if not isinstance(data, dict) or not data:
-        logging.error("❌ save_to_db: data must be a non-empty dict.")
+def save_predicted_pois(rows):
+    """
+    Bulk-insert predicted POI rows collected over a whole cycle.
+    Rows are (client_id, predicted_lat, predicted_lon, predicted_visit_time, prediction_type, created_at).
+    COPY into a transaction-scoped staging table, then one INSERT ... SELECT so ON CONFLICT still applies.
+    """
+    if not rows:
         return
 
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
-            columns, placeholders, values = [], [], []
-
-            for key, value in data.items():
-                if key == "geom" and isinstance(value, dict):
-                    columns.append("geom")
-                    placeholders.append("ST_SetSRID(ST_MakePoint(%s, %s), 4326)")
-                    values.extend([value["lon"], value["lat"]])
-                else:
-                    columns.append(key)
-                    placeholders.append("%s")
-                    values.append(value)
-
-            query = f"""
-                INSERT INTO {table} ({', '.join(columns)})
-                VALUES ({', '.join(placeholders)})
+        with db_conn() as conn, conn.transaction(), conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE predicted_pois_stage (
+                    client_id TEXT,
+                    predicted_lat FLOAT,
+                    predicted_lon FLOAT,
+                    predicted_visit_time TIMESTAMP,
+                    prediction_type VARCHAR(10),
+                    created_at TIMESTAMP
+                ) ON COMMIT DROP
+            """)
+            with cursor.copy(
+                "COPY predicted_pois_stage (client_id, predicted_lat, predicted_lon, "
+                "predicted_visit_time, prediction_type, created_at) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    copy.write_row(row)
+            cursor.execute("""
+                INSERT INTO predicted_pois_sequence (
+                    client_id, predicted_lat, predicted_lon, predicted_visit_time,
+                    prediction_type, geom, created_at
+                )
+                SELECT client_id, predicted_lat, predicted_lon, predicted_visit_time,
+                       prediction_type, ST_SetSRID(ST_MakePoint(predicted_lon, predicted_lat), 4326), created_at
+                FROM predicted_pois_stage
                 ON CONFLICT DO NOTHING
-            """
-            cursor.execute(query, values)
-            logging.info(f"✅ Saved row to {table}")
+            """)
+        logging.info(f"✅ Saved {len(rows)} predicted POI row(s) to predicted_pois_sequence")
     except psycopg.Error as e:
-        logging.error(f"❌ save_to_db failed: {e}")
+        logging.error(f"❌ save_predicted_pois failed: {e}")
@@ -1,7 +1,7 @@
 import os
 import logging
 import time
-from db.db_connection import fetch_latest_trajectories, load_from_db
+from db.db_connection import fetch_latest_trajectories, load_from_db, save_predicted_pois
 from predict_pois import predict_next_poi, get_poi_and_patterns
 
 logging.basicConfig(level=logging.INFO)
@@ -21,17 +21,21 @@ def main():
         now = time.time()
         run_weekly = ENABLE_WEEKLY and (now - _last_weekly_ts >= WEEKLY_INTERVAL_SEC)
 
+        pending_rows = []
         for client_id in clients:
             # Daily: always try; fall back handled downstream if sequence ends up empty.
             logging.info(f"🧠 Daily predict → {client_id}")
-            seq_daily = predict_next_poi(client_id, "daily", get_poi_and_patterns)
+            seq_daily = predict_next_poi(client_id, "daily", get_poi_and_patterns, pending_rows)
             if not seq_daily:
                 logging.info(f"ℹ️ {client_id}: no POI/pattern signal yet — routing will use stop-point fallback.")
 
             # Weekly: only on cadence (self-healing)
             if run_weekly:
                 logging.info(f"🧠 Weekly predict → {client_id}")
-                _ = predict_next_poi(client_id, "weekly", get_poi_and_patterns)
+                _ = predict_next_poi(client_id, "weekly", get_poi_and_patterns, pending_rows)
+
+        # One bulk write per sweep instead of one INSERT per cluster
+        save_predicted_pois(pending_rows)
 
         if run_weekly:
             _last_weekly_ts = now
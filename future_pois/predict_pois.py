@@ -3,16 +3,15 @@ import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from shapely.geometry import Point
-from sklearn.cluster import DBSCAN
-from db.db_connection import get_db_connection, save_to_db
+from db.db_connection import db_conn, save_predicted_pois
+
+CLUSTER_CELL_DEG = 0.0015  # grid cell used to merge nearby predictions
 
 DAY_DECAY = 1 / (24 * 3600)
 WEEK_DECAY = 1 / (7 * 24 * 3600)
 
 
 def get_poi_and_patterns(client_id):
-    conn = get_db_connection()
-
     pois_q = """
         SELECT lat, lon, time_spent, poi_rank, created_at 
         FROM pois 
@@ -28,21 +27,23 @@ def get_poi_and_patterns(client_id):
 
     pois_df, patterns_df = pd.DataFrame(), pd.DataFrame()
 
-    with conn.cursor() as cur:
-        cur.execute(pois_q, (client_id,))
-        pois = cur.fetchall()
-        if pois:
-            pois_df = pd.DataFrame(pois, columns=["lat", "lon", "time_spent", "poi_rank", "created_at"])
+    # Both queries go out in one pipeline sync: one round-trip instead of two
+    with db_conn() as conn, conn.cursor() as pois_cur, conn.cursor() as patterns_cur:
+        with conn.pipeline():
+            pois_cur.execute(pois_q, (client_id,))
+            patterns_cur.execute(patterns_q, (client_id,))
+        pois = pois_cur.fetchall()
+        patterns = patterns_cur.fetchall()
 
-        cur.execute(patterns_q, (client_id,))
-        patterns = cur.fetchall()
-        if patterns:
-            patterns_df = pd.DataFrame(patterns, columns=["lat", "lon", "pattern_type", "timestamp"])
+    if pois:
+        pois_df = pd.DataFrame(pois, columns=["lat", "lon", "time_spent", "poi_rank", "created_at"])
+    if patterns:
+        patterns_df = pd.DataFrame(patterns, columns=["lat", "lon", "pattern_type", "timestamp"])
 
     return pois_df, patterns_df
 
 
-def predict_next_poi(client_id, prediction_type, fetch_data_fn):
+def predict_next_poi(client_id, prediction_type, fetch_data_fn, pending_rows=None):
     pois_df, patterns_df = fetch_data_fn(client_id)
     if pois_df.empty:
         logging.warning(f"⚠ No POIs for {client_id}")
@@ -53,12 +54,20 @@ def predict_next_poi(client_id, prediction_type, fetch_data_fn):
 
     pois_df["created_at"] = pd.to_datetime(pois_df["created_at"])
     pois_df["time_weight"] = np.log(pois_df["time_spent"] + 1)
-    pois_df["time_decay"] = np.exp(-(now - pois_df["created_at"]).dt.total_seconds() * decay_factor)
+    created = pois_df["created_at"].to_numpy(dtype="datetime64[ns]")
+    age_seconds = (np.datetime64(now, "ns") - created).view("i8") / 1e9
+    pois_df["time_decay"] = np.exp(-age_seconds * decay_factor)
 
+    # Each pattern within ~0.002° of a POI adds 1.5 to its weight (broadcast POI × pattern matrix)
     pois_df["pattern_weight"] = 1.0
-    for _, row in patterns_df.iterrows():
-        match = (abs(pois_df["lat"] - row["lat"]) < 0.002) & (abs(pois_df["lon"] - row["lon"]) < 0.002)
-        pois_df.loc[match, "pattern_weight"] += 1.5
+    if not patterns_df.empty:
+        poi_xy = pois_df[["lat", "lon"]].to_numpy(dtype=np.float64)
+        pat_xy = patterns_df[["lat", "lon"]].to_numpy(dtype=np.float64)
+        hits = (
+            (np.abs(poi_xy[:, None, 0] - pat_xy[None, :, 0]) < 0.002)
+            & (np.abs(poi_xy[:, None, 1] - pat_xy[None, :, 1]) < 0.002)
+        )
+        pois_df["pattern_weight"] = 1.0 + 1.5 * hits.sum(axis=1)
 
     pois_df["poi_score"] = pois_df["poi_rank"] * pois_df["time_weight"] * pois_df["time_decay"] * pois_df[
         "pattern_weight"]
@@ -75,39 +84,49 @@ def predict_next_poi(client_id, prediction_type, fetch_data_fn):
         })
         estimated_time += timedelta(seconds=avg_time)
 
-    store_predicted_poi_sequence(client_id, visit_sequence, prediction_type)
+    store_predicted_poi_sequence(client_id, visit_sequence, prediction_type, pending_rows)
     return visit_sequence
 
 
-def store_predicted_poi_sequence(client_id, visit_sequence, prediction_type):
+def store_predicted_poi_sequence(client_id, visit_sequence, prediction_type, pending_rows=None):
+    """
+    Cluster the visit sequence and queue one row per cluster.
+    Rows go to pending_rows when given (flushed once per cycle by the caller), otherwise they are saved right away.
+    """
     if not visit_sequence:
         logging.warning(f"⚠ No sequence to store for {client_id}")
         return
 
     try:
-        coords = np.array([[poi["lat"], poi["lon"]] for poi in visit_sequence])
-        db = DBSCAN(eps=0.0015, min_samples=1).fit(coords)
-
-        now = pd.Timestamp.utcnow()
-        labels = db.labels_
-
-        for label in set(labels):
-            group = coords[labels == label]
-            center = group.mean(axis=0)
-            visit_time = visit_sequence[labels.tolist().index(label)]["predicted_visit_time"]
-
-            row = {
-                "client_id": client_id,
-                "predicted_lat": float(center[0]),
-                "predicted_lon": float(center[1]),
-                "predicted_visit_time": visit_time,
-                "prediction_type": prediction_type,
-                "geom": {"lat": float(center[0]), "lon": float(center[1])},
-                "created_at": now,
-            }
-
-            save_to_db("predicted_pois_sequence", row)
-
-        logging.info(f"✅ Stored {len(set(labels))} clustered predictions for {client_id}")
+        coords = np.array([[poi["lat"], poi["lon"]] for poi in visit_sequence], dtype=np.float64)
+
+        # Bucket points into CLUSTER_CELL_DEG grid cells; each occupied cell becomes one prediction
+        cells = np.floor(coords / CLUSTER_CELL_DEG).astype(np.int64)
+        _, inv = np.unique(cells, axis=0, return_inverse=True)
+        inv = inv.reshape(-1)
+        centers = np.zeros((inv.max() + 1, 2))
+        np.add.at(centers, inv, coords)
+        centers /= np.bincount(inv)[:, None]
+        _, first_idx = np.unique(inv, return_index=True)
+
+        now = pd.Timestamp.utcnow().to_pydatetime()
+
+        rows = []
+        for center, idx in zip(centers, first_idx):
+            rows.append((
+                client_id,
+                float(center[0]),
+                float(center[1]),
+                visit_sequence[idx]["predicted_visit_time"],
+                prediction_type,
+                now,
+            ))
+
+        if pending_rows is None:
+            save_predicted_pois(rows)
+        else:
+            pending_rows.extend(rows)
+
+        logging.info(f"✅ Queued {len(rows)} clustered predictions for {client_id}")
     except Exception as e:
         logging.error(f"❌ Clustering failed for {client_id}: {e}")
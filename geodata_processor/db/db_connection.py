@@ -1,48 +1,53 @@
 import os
-import time
-import json
 import logging
-import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
+from psycopg.types.json import Jsonb
 from dotenv import load_dotenv
 
 load_dotenv()
 
-db_connection = None
-
-
-def get_db_connection(retries=5, delay=5):
-    global db_connection
-    if db_connection is not None and not db_connection.closed:
-        return db_connection
-
-    for attempt in range(retries):
-        try:
-            db_connection = psycopg.connect(
-                dbname=os.getenv("POSTGRES_DB"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host=os.getenv("POSTGRES_HOST"),
-                port=os.getenv("POSTGRES_PORT", "5432"),
-                autocommit=True,
-                row_factory=dict_row
-            )
-            logging.info("✅ Connected to DB.")
-            return db_connection
-        except psycopg.OperationalError as e:
-            logging.warning(f"⚠️ Attempt {attempt + 1}: {e}")
-            time.sleep(delay)
-    raise Exception("❌ Failed to connect to the database after retries.")
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+        "prepare_threshold": 1,  # prepare repeated queries from their second execution
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
+
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
 
 
 def load_from_db(query, params=None):
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
+    with db_conn() as conn, conn.cursor() as cursor:
         cursor.execute(query, params or ())
         return cursor.fetchall()
 
 
-def fetch_migratable_sessions_and_data():
+MIGRATION_ITERSIZE = int(os.getenv("GEODATA_MIGRATION_ITERSIZE", "50000"))
+
+
+def stream_migratable_sessions_and_data():
+    """
+    Yield migratable geodata rows ordered by (client_id, session_id, timestamp)
+    through a server-side cursor, so memory stays bounded by MIGRATION_ITERSIZE rows.
+    """
     query = """
     SELECT 
         g.client_id, g.session_id,
@@ -53,27 +58,32 @@ def fetch_migratable_sessions_and_data():
     WHERE g.timestamp BETWEEN m.start_time AND m.end_time
     ORDER BY g.client_id, g.session_id, g.timestamp;
     """
-    return load_from_db(query)
+    # Named cursors need a transaction; the pool hands out autocommit connections
+    with db_conn() as conn, conn.transaction(), conn.cursor(name="migrate_stream") as cursor:
+        cursor.itersize = MIGRATION_ITERSIZE
+        cursor.execute(query)
+        yield from cursor
 
 
 def save_trajectories(data):
     if not data:
         logging.warning("⚠ No trajectory data to save.")
-        return
-
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        for client_id, session_id, trajectory in data:
-            try:
-                cursor.execute("""
-                    INSERT INTO trajectories (client_id, session_id, trajectory, created_at)
-                    VALUES (%s, %s, %s, NOW())
-                    ON CONFLICT (session_id) DO NOTHING;
-                """, (client_id, session_id, json.dumps(trajectory)))
-            except Exception as e:
-                logging.error(f"❌ Failed to save trajectory for {client_id}, session {session_id}: {e}")
-        conn.commit()
+        return False
+
+    # executemany is pipelined by psycopg, so the whole batch shares one round-trip;
+    # trajectories go over as binary JSONB (%b) so the server skips the text parse
+    try:
+        with db_conn() as conn, conn.cursor() as cursor:
+            cursor.executemany("""
+                INSERT INTO trajectories (client_id, session_id, trajectory, created_at)
+                VALUES (%s, %s, %b, NOW())
+                ON CONFLICT (session_id) DO NOTHING;
+            """, [(client_id, session_id, Jsonb(trajectory)) for client_id, session_id, trajectory in data])
+    except Exception as e:
+        logging.error(f"❌ Failed to save {len(data)} trajectory session(s): {e}")
+        return False
     logging.info(f"✅ Saved {len(data)} trajectory session(s) to the database.")
+    return True
 
 
 def delete_migrated_geodata_by_session_keys(session_keys):
@@ -85,17 +95,16 @@ def delete_migrated_geodata_by_session_keys(session_keys):
         logging.info("✅ No migrated geodata to delete.")
         return
 
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        placeholders = ",".join(["(%s, %s)"] * len(session_keys))
-        flat_params = [item for pair in session_keys for item in pair]
-
-        query = f"""
+    # Fixed SQL (arrays instead of N placeholders) so one prepared plan serves any batch size
+    client_ids = [client_id for client_id, _ in session_keys]
+    session_ids = [session_id for _, session_id in session_keys]
+    with db_conn() as conn, conn.cursor() as cursor:
+        cursor.execute("""
             DELETE FROM geodata
-            WHERE (client_id, session_id) IN ({placeholders});
-        """
-        cursor.execute(query, flat_params)
-        conn.commit()
+            WHERE (client_id, session_id) IN (
+                SELECT * FROM unnest(%s::text[], %s::int[])
+            );
+        """, (client_ids, session_ids))
 
     logging.info(f"🧹 Cleared migrated geodata for {len(session_keys)} sessions.")
 
@@ -1,56 +1,61 @@
+import os
 import time
 import logging
-import pandas as pd
-from collections import defaultdict
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
 from db.db_connection import (
-    fetch_migratable_sessions_and_data,
+    stream_migratable_sessions_and_data,
     save_trajectories,
     delete_migrated_geodata_by_session_keys
 )
 
 logging.basicConfig(level=logging.INFO)
 
+SESSION_BATCH_SIZE = int(os.getenv("GEODATA_SESSION_BATCH_SIZE", "500"))
+
+
+def point_from_row(row):
+    ts = row["timestamp"]
+    return {
+        "lat": row["lat"],
+        "lon": row["lon"],
+        "elevation": row["elevation"],
+        "speed": row["speed"],
+        "activity": row["activity"],
+        "timestamp": ts.isoformat() if isinstance(ts, datetime) else ts  # psycopg returns datetime already
+    }
+
+
+def flush_sessions(trajectories):
+    # Only clear geodata that actually landed in trajectories
+    if save_trajectories(trajectories):
+        delete_migrated_geodata_by_session_keys([(client_id, session_id) for client_id, session_id, _ in trajectories])
+
 
 def migrate_geodata_to_trajectories():
     logging.info("🔁 Sovereign migration triggered...")
 
-    rows = fetch_migratable_sessions_and_data()
-    if not rows:
-        logging.info("✅ No migratable geodata found.")
-        return
-
-    grouped = defaultdict(lambda: defaultdict(list))  # grouped[client_id][session_id] = []
-
-    for row in rows:
-        grouped[row["client_id"]][row["session_id"]].append({
-            "lat": row["lat"],
-            "lon": row["lon"],
-            "elevation": row["elevation"],
-            "speed": row["speed"],
-            "activity": row["activity"],
-            "timestamp": pd.to_datetime(row["timestamp"]).isoformat()
-        })
-
-    trajectories = [
-        (client_id, session_id, points)
-        for client_id, sessions in grouped.items()
-        for session_id, points in sessions.items()
-    ]
-
-    if not trajectories:
-        logging.info("⚠ No valid grouped data to save.")
-        return
+    # Rows arrive ordered by (client_id, session_id, timestamp): group in a single streaming pass
+    # and flush every SESSION_BATCH_SIZE sessions so memory stays flat.
+    rows = stream_migratable_sessions_and_data()
+    batch, migrated = [], 0
+    for (client_id, session_id), session_rows in groupby(rows, key=itemgetter("client_id", "session_id")):
+        batch.append((client_id, session_id, [point_from_row(row) for row in session_rows]))
+        if len(batch) >= SESSION_BATCH_SIZE:
+            flush_sessions(batch)
+            migrated += len(batch)
+            batch = []
 
-    save_trajectories(trajectories)
+    if batch:
+        flush_sessions(batch)
+        migrated += len(batch)
 
-    session_keys = [
-        (client_id, session_id)
-        for client_id in grouped
-        for session_id in grouped[client_id]
-    ]
-    delete_migrated_geodata_by_session_keys(session_keys)
+    if not migrated:
+        logging.info("✅ No migratable geodata found.")
+        return
 
-    logging.info(f"✅ Migrated and cleared {len(session_keys)} sessions.")
+    logging.info(f"✅ Migrated and cleared {migrated} sessions.")
 
 
 if __name__ == "__main__":
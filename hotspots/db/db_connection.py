@@ -1,51 +1,45 @@
 import logging
-import time
-import psycopg
-from geoalchemy2.shape import to_shape
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
-# Global connection pool
-db_connection = None
-
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-
-def get_db_connection(retries=5, delay=5):
-    """Establishes a persistent PostgreSQL connection with retry logic."""
-    global db_connection
-    if db_connection is not None:
-        return db_connection
-
-    for attempt in range(retries):
-        try:
-            db_connection = psycopg.connect(
-                dbname=os.getenv("POSTGRES_DB"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host=os.getenv("POSTGRES_HOST"),
-                port=os.getenv("POSTGRES_PORT"),
-                autocommit=True,
-                row_factory=dict_row
-            )
-            logging.info("✅ Successfully connected to the database.")
-            return db_connection
-        except psycopg.OperationalError as e:
-            logging.error(f"❌ Database connection attempt {attempt + 1}/{retries} failed: {e}")
-            time.sleep(delay)
-
-    raise Exception("❌ Failed to connect to the database after multiple attempts")
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+        "prepare_threshold": 1,  # prepare repeated queries from their second execution
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
+
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
 
 
 def load_from_db(query, params=None):
     """Executes a SELECT query and returns the results."""
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
+        with db_conn() as conn, conn.cursor() as cursor:
             cursor.execute(query, params or ())
             return cursor.fetchall()
     except Exception as e:
@@ -83,29 +77,101 @@ def insert_hotspots(hotspots):
     """
     query = """
     INSERT INTO hotspots (client_id, lat, lon, radius, density, type, geom, created_at)
-    VALUES (%s, %s, %s, %s, %s, %s, ST_SetSRID(ST_GeomFromText(%s), 4326), NOW())
+    VALUES (%s, %s, %s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), NOW())
     ON CONFLICT (client_id, lat, lon) DO UPDATE 
     SET radius = EXCLUDED.radius, density = EXCLUDED.density, updated_at = NOW();
     """
-    conn = get_db_connection()
+    if not hotspots:
+        return
+
+    rows = [
+        (
+            hotspot["client_id"],
+            hotspot["lat"],
+            hotspot["lon"],
+            hotspot["radius"],
+            hotspot["density"],
+            hotspot.get("type", "hotspot"),
+            hotspot["lon"],
+            hotspot["lat"]
+        )
+        for hotspot in hotspots
+    ]
+
     try:
-        with conn.cursor() as cursor:
-            for hotspot in hotspots:
-                geom_wkt = to_shape(hotspot["geom"]).wkt
-                cursor.execute(query, (
-                    hotspot["client_id"],
-                    hotspot["lat"],
-                    hotspot["lon"],
-                    hotspot["radius"],
-                    hotspot["density"],
-                    hotspot.get("type", "hotspot"),
-                    geom_wkt
-                ))
-        logging.info("✅ Hotspot data inserted into database.")
+        with db_conn() as conn, conn.cursor() as cursor:
+            cursor.executemany(query, rows)
+        logging.info(f"✅ {len(rows)} hotspot(s) inserted into database.")
     except Exception as e:
         logging.error(f"❌ Error saving hotspot data: {e}")
 
 
+def cluster_hotspots_in_db(eps_m, min_samples=5, earth_radius_m=6_371_000):
+    """
+    Detect and upsert hotspots entirely inside PostGIS: trajectory points and POIs never leave the database.
+    Points are projected per client onto a local equirectangular plane in meters (x scaled by the cosine of
+    the client's mean latitude), so ST_ClusterDBSCAN's planar eps matches the haversine eps of the Python path.
+    Returns the number of hotspots written.
+    """
+    query = """
+    WITH points AS (
+        SELECT t.client_id, (elem->>'lat')::float8 AS lat, (elem->>'lon')::float8 AS lon
+        FROM trajectories t,
+             LATERAL jsonb_array_elements(t.trajectory) AS elem
+        WHERE jsonb_typeof(t.trajectory) = 'array'
+          -- only numeric coordinates: one malformed point must not abort the ::float8 cast for everyone
+          AND jsonb_typeof(elem->'lat') = 'number'
+          AND jsonb_typeof(elem->'lon') = 'number'
+        UNION ALL
+        SELECT client_id, lat, lon
+        FROM pois
+        WHERE lat IS NOT NULL AND lon IS NOT NULL
+    ),
+    projected AS (
+        SELECT client_id, lat, lon,
+               ST_MakePoint(
+                   radians(lon) * cos(radians(AVG(lat) OVER (PARTITION BY client_id))) * %(earth_radius_m)s,
+                   radians(lat) * %(earth_radius_m)s
+               ) AS xy
+        FROM points
+    ),
+    clustered AS (
+        SELECT client_id, lat, lon,
+               ST_ClusterDBSCAN(xy, eps := %(eps_m)s, minpoints := %(min_samples)s)
+                   OVER (PARTITION BY client_id) AS cluster_id
+        FROM projected
+    ),
+    members AS (
+        SELECT client_id, cluster_id, lat, lon,
+               AVG(lat) OVER c AS centroid_lat,
+               AVG(lon) OVER c AS centroid_lon
+        FROM clustered
+        WHERE cluster_id IS NOT NULL
+        WINDOW c AS (PARTITION BY client_id, cluster_id)
+    )
+    INSERT INTO hotspots (client_id, lat, lon, radius, density, type, geom, created_at)
+    SELECT client_id, centroid_lat, centroid_lon,
+           MAX(ST_Distance(ST_MakePoint(lon, lat)::geography,
+                           ST_MakePoint(centroid_lon, centroid_lat)::geography, false)),
+           COUNT(*), 'hotspot', ST_SetSRID(ST_MakePoint(centroid_lon, centroid_lat), 4326), NOW()
+    FROM members
+    -- clusters of one client sharing a centroid are merged, so the upsert never hits a row twice
+    GROUP BY client_id, centroid_lat, centroid_lon
+    ON CONFLICT (client_id, lat, lon) DO UPDATE
+    SET radius = EXCLUDED.radius, density = EXCLUDED.density, updated_at = NOW();
+    """
+    params = {"eps_m": eps_m, "min_samples": min_samples, "earth_radius_m": earth_radius_m}
+    try:
+        with db_conn() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            written = cursor.rowcount
+        logging.info(f"✅ {written} hotspot(s) clustered and upserted in PostGIS.")
+        return written
+    except Exception as e:
+        logging.error(f"❌ Error clustering hotspots in database: {e}")
+        return 0
+
+
 def fetch_pois(source_type="poi"):
     query = """
     SELECT client_id, lat, lon
@@ -1,60 +1,139 @@
 # hotspot_detection.py
-from shapely.geometry import Point
-from geoalchemy2.elements import WKTElement
 from sklearn.cluster import DBSCAN
+from numba import njit
 import numpy as np
 
+EARTH_RADIUS_M = 6_371_000
+
+
+POINT_FIELDS = ("client_id", "lat", "lon", "source_type")
+
+
+@njit(cache=True, fastmath=True)
+def cluster_stats(coords_rad, labels, n_clusters):
+    """
+    Per-label centroid (degrees), haversine radius (meters), size and first member index
+    from coordinates in radians. Noise points (label -1) are ignored. One pass for sums, one for the radii.
+    """
+    sums = np.zeros((n_clusters, 2))
+    counts = np.zeros(n_clusters, dtype=np.int64)
+    first = np.full(n_clusters, -1, dtype=np.int64)
+    for i in range(labels.shape[0]):
+        label = labels[i]
+        if label < 0:
+            continue
+        sums[label, 0] += coords_rad[i, 0]
+        sums[label, 1] += coords_rad[i, 1]
+        counts[label] += 1
+        if first[label] < 0:
+            first[label] = i
+
+    centroids_rad = sums / counts.reshape(-1, 1)
+
+    radii = np.zeros(n_clusters)
+    for i in range(labels.shape[0]):
+        label = labels[i]
+        if label < 0:
+            continue
+        lat1 = coords_rad[i, 0]
+        lon1 = coords_rad[i, 1]
+        lat2 = centroids_rad[label, 0]
+        lon2 = centroids_rad[label, 1]
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        d = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+        if d > radii[label]:
+            radii[label] = d
+
+    return np.degrees(centroids_rad), radii, counts, first
+
+
+def make_points(client_ids, lats, lons, source_types):
+    """
+    Points are kept as parallel arrays (struct of arrays) rather than one dict per point.
+    """
+    return {
+        "client_id": np.asarray(client_ids, dtype=object),
+        "lat": np.asarray(lats, dtype=np.float64),
+        "lon": np.asarray(lons, dtype=np.float64),
+        "source_type": np.asarray(source_types, dtype=object),
+    }
+
+
+def points_from_records(records):
+    """Convert a list of {client_id, lat, lon, source_type} dicts into point arrays."""
+    return make_points(
+        [r["client_id"] for r in records],
+        [r["lat"] for r in records],
+        [r["lon"] for r in records],
+        [r.get("source_type", "trajectory") for r in records],
+    )
+
+
+def concat_points(*batches):
+    return {field: np.concatenate([b[field] for b in batches]) for field in POINT_FIELDS}
+
 
 def expand_trajectories(rows, source_type="trajectory"):
-    expanded = []
+    client_ids, lats, lons = [], [], []
     for row in rows:
         client_id = row["client_id"]
         trajectory = row.get("trajectory", [])
         for point in trajectory:
             if "lat" in point and "lon" in point:
-                expanded.append({
-                    "client_id": client_id,
-                    "lat": point["lat"],
-                    "lon": point["lon"],
-                    "source_type": source_type
-                })
-    return expanded
+                client_ids.append(client_id)
+                lats.append(point["lat"])
+                lons.append(point["lon"])
+    return make_points(client_ids, lats, lons, [source_type] * len(client_ids))
 
 
 def detect_hotspots(points, eps=0.005, min_samples=5):
     """
     Detect hotspots using DBSCAN patterns on geospatial points, grouped by client_id.
-    :param points: List of input points with lat, lon, client_id, source_type
+    :param points: Point arrays (see make_points) with client_id, lat, lon, source_type
     """
-    grouped = {}
-    for p in points:
-        grouped.setdefault(p["client_id"], []).append(p)
+    if points["lat"].size == 0:
+        return []
+
+    # Group by client once: stable sort on the client index, then slice each run
+    client_keys, client_idx = np.unique(points["client_id"], return_inverse=True)
+    client_idx = client_idx.reshape(-1)
+    by_client = np.argsort(client_idx, kind="stable")
+    bounds = np.r_[0, np.cumsum(np.bincount(client_idx, minlength=len(client_keys)))]
+
+    # Radians for every point in one allocation, laid out client by client,
+    # so each client's coordinates are a contiguous view rather than a gathered copy
+    coords_rad = np.empty((points["lat"].size, 2), dtype=np.float64)
+    np.deg2rad(points["lat"][by_client], out=coords_rad[:, 0])
+    np.deg2rad(points["lon"][by_client], out=coords_rad[:, 1])
+    source_types_by_client = points["source_type"][by_client]
+
+    # One configured estimator for every client; fit() resets its state each call.
+    # BallTree keeps haversine neighbor queries at O(N log N) instead of brute force
+    dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric='haversine',
+                    algorithm='ball_tree', leaf_size=40, n_jobs=-1)
 
     hotspots = []
-    for client_id, items in grouped.items():
-        coords = np.array([[p['lat'], p['lon']] for p in items])
-        db = DBSCAN(eps=eps, min_samples=min_samples, metric='haversine').fit(np.radians(coords))
-        labels = db.labels_
+    for k, client_id in enumerate(client_keys):
+        coords = coords_rad[bounds[k]:bounds[k + 1]]
+        source_types = source_types_by_client[bounds[k]:bounds[k + 1]]
+
+        labels = dbscan.fit(coords).labels_
 
-        for label in set(labels):
-            if label == -1:
-                continue
+        n_clusters = labels.max() + 1
+        if n_clusters == 0:
+            continue
 
-            cluster_points = coords[labels == label]
-            cluster_items = [items[i] for i in range(len(labels)) if labels[i] == label]
-            centroid_lat = np.mean(cluster_points[:, 0])
-            centroid_lon = np.mean(cluster_points[:, 1])
-            radius = max(np.linalg.norm(cluster_points - [centroid_lat, centroid_lon], axis=1)) * 111_000
+        centroids, radii, counts, first_members = cluster_stats(coords, labels.astype(np.int64), n_clusters)
 
+        for (centroid_lat, centroid_lon), radius, density, first in zip(centroids, radii, counts, first_members):
             hotspots.append({
                 "client_id": client_id,
                 "lat": centroid_lat,
                 "lon": centroid_lon,
                 "radius": radius,
-                "density": len(cluster_points),
+                "density": int(density),
                 "type": "hotspot",
-                "source_type": cluster_items[0].get("source_type", "trajectory"),
-                "geom": WKTElement(f"POINT({centroid_lon} {centroid_lat})", srid=4326)
+                "source_type": source_types[first],
             })
 
     return hotspots
\ No newline at end of file
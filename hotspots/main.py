@@ -1,15 +1,32 @@
+import os
 import logging
 from db.db_connection import (
+    cluster_hotspots_in_db,
     fetch_historical_trajectories,
     fetch_pois,
     insert_hotspots
 )
-from hotspot_detection import detect_hotspots, expand_trajectories
+from hotspot_detection import (
+    EARTH_RADIUS_M, detect_hotspots, expand_trajectories, points_from_records, concat_points
+)
 
 logging.basicConfig(level=logging.INFO)
 
+# Opt-in: cluster with ST_ClusterDBSCAN next to the data instead of DBSCAN in Python
+HOTSPOTS_IN_DB = os.getenv("HOTSPOTS_IN_DB", "0") == "1"
+HOTSPOT_EPS_RAD = float(os.getenv("HOTSPOT_EPS_RAD", "0.005"))
+HOTSPOT_MIN_SAMPLES = int(os.getenv("HOTSPOT_MIN_SAMPLES", "5"))
+
 
 def process_hotspots():
+    if HOTSPOTS_IN_DB:
+        logging.info("\U0001F680 Clustering hotspots in PostGIS...")
+        if not cluster_hotspots_in_db(HOTSPOT_EPS_RAD * EARTH_RADIUS_M, HOTSPOT_MIN_SAMPLES):
+            logging.warning("\u26a0 No hotspots detected.")
+            return
+        logging.info("\u2705 Hotspot processing completed.")
+        return
+
     logging.info("\U0001F680 Fetching input vectors for hotspot detection...")
 
     # Historical movement base
@@ -17,16 +34,16 @@ def process_hotspots():
     trajectory_points = expand_trajectories(historical_data, source_type="trajectory")
 
     # Points of Interest
-    poi_data = fetch_pois()
+    poi_points = points_from_records(fetch_pois())
 
     # Combine input sources
-    combined_data = trajectory_points + poi_data
+    combined_data = concat_points(trajectory_points, poi_points)
 
-    if not combined_data:
+    if combined_data["lat"].size == 0:
         logging.warning("\u26a0 No data available for hotspot detection.")
         return
 
-    hotspots = detect_hotspots(combined_data)
+    hotspots = detect_hotspots(combined_data, eps=HOTSPOT_EPS_RAD, min_samples=HOTSPOT_MIN_SAMPLES)
 
     if not hotspots:
         logging.warning("\u26a0 No hotspots detected.")
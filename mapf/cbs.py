@@ -2,20 +2,22 @@ import logging
 import random
 import time as timer
 import heapq
-from db.db_connection import fetch_astar_path  # 🧠 new helper for path loading
+from db.db_connection import fetch_astar_paths_bulk  # 🧠 one query for every goal's A* path
 
 logging.basicConfig(level=logging.INFO)
 
 
 class CBSSolver:
-    def __init__(self, client_id, goals, get_sum_of_cost, max_time=None):
+    def __init__(self, client_id, goals, get_sum_of_cost, max_time=None, paths=None):
         """
         Initialize CBSSolver to fetch precomputed A* paths from DB instead of calling A* directly.
+        :param paths: optional A* paths already loaded for each goal (skips the per-goal DB lookup)
         """
         self.client_id = client_id
         self.goals = goals
         self.get_sum_of_cost = get_sum_of_cost
         self.max_time = max_time if max_time else float("inf")
+        self.paths = paths
         self.start_time = timer.time()
         self.open_list = []
         self.num_of_generated = 0
@@ -34,8 +36,9 @@ class CBSSolver:
         """Use precomputed A* path from database to build CBS-compatible response."""
         root = {"cost": 0, "constraints": [], "paths": [], "collisions": []}
 
-        for goal in self.goals:
-            path = fetch_astar_path(self.client_id, goal)
+        paths_by_goal = None if self.paths else fetch_astar_paths_bulk(self.client_id, self.goals)
+        for i, goal in enumerate(self.goals):
+            path = self.paths[i] if self.paths else paths_by_goal.get((goal[0], goal[1]))
             if path is None:
                 raise Exception(f"❌ No A* path found for {self.client_id} to {goal}")
             root["paths"].append(path)
@@ -1,45 +1,48 @@
 import logging
+import random
 import time
-import psycopg
 import os
 import pandas as pd
 import geopandas as gpd
+import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
 from dotenv import load_dotenv
+import numpy as np
+import shapely
 from shapely.wkb import loads
 
 load_dotenv()
-db_connection = None
-
-
-def get_db_connection(retries=5, delay=5):
-    global db_connection
-    if db_connection and not db_connection.closed:
-        return db_connection
-
-    for attempt in range(retries):
-        try:
-            db_connection = psycopg.connect(
-                dbname=os.getenv("POSTGRES_DB"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host=os.getenv("POSTGRES_HOST"),
-                port=os.getenv("POSTGRES_PORT", "5432"),
-                autocommit=True,
-                row_factory=dict_row
-            )
-            logging.info("✅ Successfully connected to the database.")
-            return db_connection
-        except psycopg.OperationalError as e:
-            logging.warning(f"⚠ Attempt {attempt + 1}: {e}")
-            time.sleep(delay)
-    raise Exception("❌ Failed to connect to database.")
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+        "prepare_threshold": 1,  # prepare repeated queries from their second execution
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
+
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
 
 
 def load_from_db(query, params=None):
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
+        with db_conn() as conn, conn.cursor() as cursor:
             cursor.execute(query, params or ())
             return cursor.fetchall()
     except Exception as e:
@@ -48,9 +51,8 @@ def load_from_db(query, params=None):
 
 
 def save_to_db(query, params):
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
+        with db_conn() as conn, conn.cursor() as cursor:
             cursor.execute(query, params)
         logging.info("✅ Saved MAPF route.")
     except Exception as e:
@@ -63,6 +65,48 @@ def fetch_active_clients():
     return [row["client_id"] for row in result] if result else []
 
 
+def paths_from_wkb(blobs):
+    """Decode a batch of WKB LineStrings in one vectorized call; None stays None."""
+    geoms = shapely.from_wkb(np.asarray(blobs, dtype=object))
+    return [list(geom.coords) if geom is not None else None for geom in geoms]
+
+
+# Dedicated LISTEN connection (notifications are per-session, so it cannot come from the pool)
+ACTIVE_CLIENTS_CHANNEL = "active_clients_changed"
+NOTIFY_BATCH_WINDOW_SEC = float(os.getenv("MAPF_NOTIFY_BATCH_WINDOW_SEC", "5"))
+_listen_conn = None
+
+
+def wait_for_active_client_changes(timeout):
+    """
+    Block up to `timeout` seconds for geodata notifications, then gather the burst
+    for NOTIFY_BATCH_WINDOW_SEC. Returns the set of client_ids that received geodata,
+    or None when the listener is unavailable (callers fall back to the full client list).
+    """
+    global _listen_conn
+    try:
+        if _listen_conn is None or _listen_conn.closed:
+            _listen_conn = psycopg.connect(
+                dbname=os.getenv("POSTGRES_DB"),
+                user=os.getenv("POSTGRES_USER"),
+                password=os.getenv("POSTGRES_PASSWORD"),
+                host=os.getenv("POSTGRES_HOST"),
+                port=os.getenv("POSTGRES_PORT", "5432"),
+                autocommit=True,
+            )
+            _listen_conn.execute(f"LISTEN {ACTIVE_CLIENTS_CHANNEL}")
+
+        changed = {n.payload for n in _listen_conn.notifies(timeout=timeout, stop_after=1)}
+        if changed:
+            changed.update(n.payload for n in _listen_conn.notifies(timeout=NOTIFY_BATCH_WINDOW_SEC))
+        return changed
+    except psycopg.Error as e:
+        logging.warning(f"⚠ Active-client listener failed, falling back to polling: {e}")
+        _listen_conn = None
+        time.sleep(timeout)
+        return None
+
+
 def fetch_latest_location(client_id):
     query = """
     SELECT lat, lon, updated_at
@@ -88,44 +132,82 @@ def fetch_next_predicted_poi(client_id):
     if not result:
         return gpd.GeoDataFrame(columns=["lat", "lon", "timestamp", "geom"])
     df = pd.DataFrame(result)
-    df["geom"] = df["geom"].apply(lambda x: loads(x) if x else None)
+    df["geom"] = shapely.from_wkb(df["geom"].to_numpy(dtype=object))
     return gpd.GeoDataFrame(df, geometry="geom", crs="EPSG:4326")
 
 
+# Static GTFS stops cached in memory so fallback sampling skips a full scan + sort
+STOP_CACHE_TTL_SEC = int(os.getenv("MAPF_STOP_CACHE_TTL_SEC", "3600"))
+_stop_cache = {"loaded_at": 0.0, "stops": []}
+
+
 def fetch_fallback_stop():
-    query = """
-    SELECT stop_lat AS lat, stop_lon AS lon
-    FROM gtfs_stops
-    WHERE location_type = 0
-    ORDER BY RANDOM()
-    LIMIT 1;
+    now = time.monotonic()
+    if not _stop_cache["stops"] or now - _stop_cache["loaded_at"] >= STOP_CACHE_TTL_SEC:
+        query = """
+        SELECT stop_lat AS lat, stop_lon AS lon
+        FROM gtfs_stops
+        WHERE location_type = 0;
+        """
+        result = load_from_db(query)
+        if result:
+            _stop_cache["stops"] = [(row["lat"], row["lon"]) for row in result]
+            _stop_cache["loaded_at"] = now
+
+    return random.choice(_stop_cache["stops"]) if _stop_cache["stops"] else None
+
+
+def fetch_astar_targets_bulk(client_ids):
     """
-    result = load_from_db(query)
-    return (result[0]["lat"], result[0]["lon"]) if result else None
-
+    Latest A* route per client for a whole batch in one query.
+    Returns {client_id: {destination_lat, destination_lon, target_type, stop_id, path}}
+    where path is a list of (lon, lat) coords or None.
+    """
+    if not client_ids:
+        return {}
 
-def fetch_astar_target(client_id):
     query = """
-    SELECT destination_lat, destination_lon, target_type, stop_id
+    SELECT DISTINCT ON (client_id)
+        client_id, destination_lat, destination_lon, target_type, stop_id,
+        ST_AsBinary(path) AS path
     FROM astar_routes
-    WHERE client_id = %s
-    ORDER BY created_at DESC
-    LIMIT 1;
+    WHERE client_id = ANY(%s)
+    ORDER BY client_id, created_at DESC;
     """
-    result = load_from_db(query, (client_id,))
-    return result[0] if result else None
+    result = load_from_db(query, (list(client_ids),))
+    if not result:
+        return {}
+
+    targets = {}
+    for row, path in zip(result, paths_from_wkb([row["path"] for row in result])):
+        row["path"] = path
+        targets[row["client_id"]] = row
+    return targets
+
 
+def fetch_astar_paths_bulk(client_id, goals):
+    """
+    Latest A* path for each (lat, lon) goal of one client, in one query.
+    Returns {(lat, lon): [coords]}; goals without a stored route are absent.
+    """
+    if not goals:
+        return {}
 
-def fetch_astar_path(client_id, destination):
     query = """
-    SELECT ST_AsBinary(path) AS path
-    FROM astar_routes
-    WHERE client_id = %s
-      AND destination_lat = %s AND destination_lon = %s
-    ORDER BY created_at DESC
-    LIMIT 1;
+    WITH goals (lat, lon) AS (
+        SELECT * FROM unnest(%s::float8[], %s::float8[])
+    )
+    SELECT DISTINCT ON (g.lat, g.lon) g.lat, g.lon, ST_AsBinary(a.path) AS path
+    FROM goals g
+    JOIN astar_routes a
+      ON a.client_id = %s
+     AND a.destination_lat = g.lat AND a.destination_lon = g.lon
+    ORDER BY g.lat, g.lon, a.created_at DESC;
     """
-    result = load_from_db(query, (client_id, destination[0], destination[1]))
-    if result:
-        return list(loads(result[0]["path"]).coords)
-    return None
+    lats = [goal[0] for goal in goals]
+    lons = [goal[1] for goal in goals]
+    result = load_from_db(query, (lats, lons, client_id))
+    if not result:
+        return {}
+    paths = paths_from_wkb([row["path"] for row in result])
+    return {(row["lat"], row["lon"]): path for row, path in zip(result, paths) if path}
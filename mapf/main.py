@@ -1,47 +1,100 @@
+import os
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from db.db_connection import (
     fetch_active_clients,
-    fetch_astar_target,
-    fetch_astar_path,
+    fetch_astar_targets_bulk,
+    wait_for_active_client_changes,
 )
 from mapf_engine import run_mapf_for_client
 
 logging.basicConfig(level=logging.INFO)
 
+# Clients are independent; threads overlap their DB round-trips (bounded by the connection pool)
+MAPF_WORKERS = int(os.getenv("MAPF_WORKERS", "8"))
+
+# Full active-client refresh cadence; in between only clients with new geodata (LISTEN/NOTIFY) are processed
+CLIENT_REFRESH_SEC = int(os.getenv("MAPF_CLIENT_REFRESH_SEC", "300"))
+IDLE_WAIT_SEC = 60
+# A client is solved again only when its A* target/stop changed or this long after its last solve,
+# so a steady geodata stream doesn't re-run CBS (and add a mapf_routes row) every notify batch
+CLIENT_MIN_INTERVAL_SEC = int(os.getenv("MAPF_CLIENT_MIN_INTERVAL_SEC", "60"))
+
+
+def target_key(target):
+    if not target:
+        return None
+    return target["destination_lat"], target["destination_lon"], target.get("stop_id")
+
+
+def process_client(client_id, target):
+    try:
+        if not target:
+            logging.info(f"⚠ No A* target for {client_id}")
+            return
+
+        destination = (target["destination_lat"], target["destination_lon"])
+        stop_id = target.get("stop_id")  # ✅ GTFS stop_id from astar_routes
+
+        if not stop_id:
+            logging.warning(f"⚠ No stop_id found for {client_id}")
+            return
+
+        run_mapf_for_client(client_id, destination, stop_id, path=target.get("path"))
+
+    except Exception as e:
+        logging.error(f"❌ MAPF error for {client_id}: {e}", exc_info=True)
+
 
 def main():
     logging.info("🚀 MAPF Module started.")
     time.sleep(60)  # startup grace
 
+    active_clients = set()
+    last_refresh = float("-inf")
+    last_solved = {}  # client_id -> (monotonic time, target_key) of its last MAPF run
+
     while True:
-        clients = fetch_active_clients()
+        if time.monotonic() - last_refresh >= CLIENT_REFRESH_SEC:
+            active_clients = set(fetch_active_clients())
+            last_refresh = time.monotonic()
+            # forget clients that are no longer active
+            last_solved = {c: v for c, v in last_solved.items() if c in active_clients}
+            clients = sorted(active_clients)
+        else:
+            changed = wait_for_active_client_changes(timeout=IDLE_WAIT_SEC)
+            if changed is None:
+                clients = sorted(active_clients)
+            else:
+                active_clients |= changed
+                clients = sorted(changed)
+
         if not clients:
-            logging.info("⏳ No active clients. Sleeping...")
-            time.sleep(60)
+            logging.info("⏳ No active clients with new geodata. Waiting...")
             continue
 
-        for client_id in clients:
-            try:
-                target = fetch_astar_target(client_id)
-                if not target:
-                    logging.info(f"⚠ No A* target for {client_id}")
-                    continue
-
-                destination = (target["destination_lat"], target["destination_lon"])
-                stop_id = target.get("stop_id")  # ✅ GTFS stop_id from astar_routes
+        # One query for every client's latest A* target and path instead of one per client
+        targets = fetch_astar_targets_bulk(clients)
 
-                if not stop_id:
-                    logging.warning(f"⚠ No stop_id found for {client_id}")
-                    continue
+        now = time.monotonic()
+        due = []
+        for client_id in clients:
+            key = target_key(targets.get(client_id))
+            previous = last_solved.get(client_id)
+            if previous and previous[1] == key and now - previous[0] < CLIENT_MIN_INTERVAL_SEC:
+                continue
+            due.append(client_id)
+            last_solved[client_id] = (now, key)
+        clients = due
 
-                run_mapf_for_client(client_id, destination, stop_id)
+        if not clients:
+            continue
 
-            except Exception as e:
-                logging.error(f"❌ MAPF error for {client_id}: {e}", exc_info=True)
+        with ThreadPoolExecutor(max_workers=MAPF_WORKERS) as executor:
+            list(executor.map(process_client, clients, [targets.get(client_id) for client_id in clients]))
 
-        logging.info("😴 MAPF cycle complete. Sleeping 60s...")
-        time.sleep(60)
+        logging.info(f"😴 MAPF cycle complete for {len(clients)} client(s).")
 
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 import logging
+from shapely import wkb
 from shapely.geometry import LineString
 from cbs import CBSSolver
 from db.db_connection import save_to_db
@@ -6,7 +7,7 @@ from db.db_connection import save_to_db
 logging.basicConfig(level=logging.INFO)
 
 
-def run_mapf_for_client(client_id, destination_coords, stop_id=None):
+def run_mapf_for_client(client_id, destination_coords, stop_id=None, path=None):
     logging.info(f"🧠 Running MAPF for client_id={client_id}, stop_id={stop_id}...")
 
     try:
@@ -14,7 +15,8 @@ def run_mapf_for_client(client_id, destination_coords, stop_id=None):
             client_id=client_id,
             goals=[destination_coords],
             get_sum_of_cost=lambda paths: sum(len(p) for p in paths),
-            max_time=10
+            max_time=10,
+            paths=[path] if path else None
         )
         paths = cbs_solver.find_solution()
         if not paths or not paths[0]:
@@ -27,11 +29,11 @@ def run_mapf_for_client(client_id, destination_coords, stop_id=None):
             client_id, stop_id, destination_lat, destination_lon, path,
             success, decision_context, created_at
         )
-        VALUES (%s, %s, %s, %s, ST_GeomFromText(%s, 4326), TRUE, 'mapf_predicted', NOW())
+        VALUES (%s, %s, %s, %s, ST_GeomFromEWKB(%s), TRUE, 'mapf_predicted', NOW())
         ON CONFLICT DO NOTHING;
         """
         lat, lon = destination_coords
-        save_to_db(query, (client_id, stop_id, lat, lon, linestring.wkt))
+        save_to_db(query, (client_id, stop_id, lat, lon, wkb.dumps(linestring, srid=4326)))
         logging.info(f"✅ MAPF route saved for {client_id}")
 
     except Exception as e:
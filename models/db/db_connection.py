@@ -1,60 +1,67 @@
 import os
 import logging
-import time
-import psycopg
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from psycopg.rows import dict_row
-from shapely import wkb
+from psycopg.rows import dict_row, tuple_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
+import shapely
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# ✅ Ensure default PostgreSQL port if missing
-POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
-
-# ✅ Global database connection
-db_connection = None
-
-
-def get_db_connection(retries=5, delay=5):
-    global db_connection
-    if db_connection is not None and not db_connection.closed:
-        return db_connection
-
-    for attempt in range(retries):
-        try:
-            db_connection = psycopg.connect(
-                dbname=os.getenv('POSTGRES_DB'),
-                user=os.getenv('POSTGRES_USER'),
-                password=os.getenv('POSTGRES_PASSWORD'),
-                host=os.getenv('POSTGRES_HOST'),
-                port=POSTGRES_PORT,
-                autocommit=True,
-                row_factory=dict_row
-            )
-            logging.info("✅ Successfully connected to the database.")
-            return db_connection
-        except psycopg.OperationalError as e:
-            logging.warning(f"⚠️ Attempt {attempt + 1}/{retries} failed: {e}")
-            time.sleep(delay)
-    raise Exception("❌ Failed to connect to the database after multiple attempts")
+# Activity label -> one-hot class (walk, vehicle, stationary); anything else is unknown
+ACTIVITY_CLASSES = {
+    "walk": 0, "walking": 0, "foot": 0,
+    "vehicle": 1, "bus": 1, "tram": 1, "train": 1, "car": 1, "bike": 1,
+    "stationary": 2, "idle": 2, "stop": 2,
+}
+ACTIVITY_UNKNOWN = 3
+
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
+
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
+
+
+def frame_from_rows(cursor, rows):
+    """Build a DataFrame from tuple rows and the cursor's column names (no per-row dicts)."""
+    return pd.DataFrame.from_records(rows, columns=[column.name for column in cursor.description])
 
 
 def load_from_db(query, conditions=None):
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        cursor.execute(query, conditions if conditions else ())
-        result = cursor.fetchall()
-
-    df = pd.DataFrame(result)
+    # Tuple rows go straight into columns instead of through one dict per row
+    with db_conn() as conn, conn.cursor(row_factory=tuple_row) as cursor:
+        cursor.execute(query, conditions if conditions else (), prepare=True)
+        df = frame_from_rows(cursor, cursor.fetchall())
 
     if df.empty:
         return gpd.GeoDataFrame()
 
     if "geom" in df.columns:
         # Expecting ST_AsBinary(geom) alias -> bytes
-        df["geom"] = df["geom"].apply(lambda x: wkb.loads(x) if x else None)
+        df["geom"] = shapely.from_wkb(df["geom"].to_numpy(dtype=object))  # one vectorized decode, None stays None
         return gpd.GeoDataFrame(df, geometry="geom", crs="EPSG:4326")
 
     return df
@@ -77,126 +84,114 @@ def fetch_stop_points():
     return load_from_db(query)
 
 
-def load_vehicle_arrivals_for_training():
-    """
-    Fetch timestamped vehicle positions as training points.
-    Keep a real 'timestamp' for temporal ordering.
-    """
-    query = """
-    SELECT position_lat AS lat, position_lon AS lon, created_at
-    FROM vehicle_arrivals
-    WHERE position_lat IS NOT NULL AND position_lon IS NOT NULL;
-    """
-    df = load_from_db(query)
-
-    if df.empty:
-        return pd.DataFrame()
-
-    # hour in [0,1]
-    df["hour"] = pd.to_datetime(df["created_at"], errors="coerce").dt.hour / 23.0
-    # keep timestamp for ordering
-    df.rename(columns={"created_at": "timestamp"}, inplace=True)
-
-    # placeholders
-    df["speed"] = 0.0
-    df["elevation"] = 0.0
-    df["act_walk"] = 0
-    df["act_vehicle"] = 0
-    df["act_stationary"] = 0
-    df["act_unknown"] = 1
-
-    return df[["lat", "lon", "hour", "speed", "elevation",
-               "act_walk", "act_vehicle", "act_stationary", "act_unknown", "timestamp"]]
-
-
-def load_astar_mapf_vectors():
-    """
-    Load origin-destination coordinates from astar_routes and mapf_routes tables.
-    These reflect historically chosen routes (client decisions).
-    Preserve created_at as 'timestamp' for ordering.
-    """
-    query = """
-    SELECT origin_lat AS lat, origin_lon AS lon, created_at
-    FROM astar_routes
-    WHERE origin_lat IS NOT NULL AND origin_lon IS NOT NULL
-
-    UNION
-
-    SELECT destination_lat AS lat, destination_lon AS lon, created_at
-    FROM mapf_routes
-    WHERE destination_lat IS NOT NULL AND destination_lon IS NOT NULL;
-    """
-    df = load_from_db(query)
-
-    if df.empty:
-        return pd.DataFrame()
-
-    df["hour"] = pd.to_datetime(df["created_at"], errors="coerce").dt.hour / 23.0
-    df.rename(columns={"created_at": "timestamp"}, inplace=True)
-
-    # placeholders
-    df["speed"] = 0.0
-    df["elevation"] = 0.0
-    df["act_walk"] = 0
-    df["act_vehicle"] = 0
-    df["act_stationary"] = 0
-    df["act_unknown"] = 1
-
-    return df[["lat", "lon", "hour", "speed", "elevation",
-               "act_walk", "act_vehicle", "act_stationary", "act_unknown", "timestamp"]]
+def hour_fraction(hour_int):
+    """Hour of day (0-23, extracted in SQL) scaled to [0, 1]; NULL hours stay NaN."""
+    return pd.to_numeric(hour_int, errors="coerce").astype(np.float32) / 23.0
 
 
-def load_full_trajectory_points():
-    """
-    Explodes all JSONB points from `trajectories.trajectory` into a flattened DataFrame.
+def activity_one_hot(activity):
+    """Map activity labels to class codes, then index rows of an identity matrix."""
+    codes = (
+        activity.str.strip().str.lower()
+        .map(ACTIVITY_CLASSES)
+        .fillna(ACTIVITY_UNKNOWN)
+        .astype(np.int8)
+        .to_numpy()
+    )
+    return np.eye(4, dtype=np.int8)[codes]
+
+
+TRAINING_VECTORS_ITERSIZE = int(os.getenv("MODELS_TRAINING_ITERSIZE", "200000"))
+
+
+def with_hour(query):
+    """Wrap a training-source query so Postgres also returns the hour of its timestamp."""
+    return f"SELECT u.*, EXTRACT(hour FROM u.timestamp)::int2 AS hour_int FROM ({query}) AS u"
+
+
+# Every training source, harmonized to one schema. The two big scans (vehicle arrivals and
+# the JSONB trajectory explosion) are separate queries so they can run side by side on
+# their own pooled connections; the small tabular sources share one UNION ALL.
+# Trajectory points are JSON: only numeric coordinates (and numeric or absent speed/elevation) are
+# cast, so one malformed point is skipped rather than aborting the stream. Their timestamps stay
+# text and are parsed in pandas (invalid ones become NaT), so the hour is derived there too.
+TRAINING_VECTORS_QUERIES = {
+    "tabular": with_hour("""
+        SELECT lat, lon, timestamp, 0.0::float8 AS speed, 0.0::float8 AS elevation,
+               NULL::text AS activity, 'patterns' AS source
+        FROM user_patterns
+        WHERE lat IS NOT NULL AND lon IS NOT NULL
+
+        UNION ALL
+        SELECT lat, lon, visit_start, 0.0, 0.0, NULL, 'pois'
+        FROM pois
+        WHERE lat IS NOT NULL AND lon IS NOT NULL
+
+        UNION ALL
+        SELECT predicted_lat, predicted_lon, predicted_visit_time, 0.0, 0.0, NULL, 'pois_sequence'
+        FROM predicted_pois_sequence
+        WHERE predicted_lat IS NOT NULL AND predicted_lon IS NOT NULL
+
+        UNION ALL
+        SELECT origin_lat, origin_lon, created_at, 0.0, 0.0, NULL, 'astar_mapf'
+        FROM astar_routes
+        WHERE origin_lat IS NOT NULL AND origin_lon IS NOT NULL
+
+        UNION ALL
+        SELECT destination_lat, destination_lon, created_at, 0.0, 0.0, NULL, 'astar_mapf'
+        FROM mapf_routes
+        WHERE destination_lat IS NOT NULL AND destination_lon IS NOT NULL
+
+        UNION ALL
+        SELECT stop_lat, stop_lon, NULL::timestamp, 0.0, 0.0, NULL, 'gtfs'
+        FROM view_static_gtfs_unified
+        WHERE stop_lat IS NOT NULL AND stop_lon IS NOT NULL
+    """),
+    "vehicle_arrivals": with_hour("""
+        SELECT position_lat AS lat, position_lon AS lon, created_at AS timestamp,
+               0.0::float8 AS speed, 0.0::float8 AS elevation,
+               NULL::text AS activity, 'vehicle_arrivals' AS source
+        FROM vehicle_arrivals
+        WHERE position_lat IS NOT NULL AND position_lon IS NOT NULL
+    """),
+    "trajectory": """
+        SELECT
+            (point->>'lat')::float8 AS lat,
+            (point->>'lon')::float8 AS lon,
+            point->>'timestamp' AS timestamp,
+            CASE WHEN jsonb_typeof(point->'speed') = 'number'
+                 THEN (point->>'speed')::float8 ELSE 0.0 END AS speed,
+            CASE WHEN jsonb_typeof(point->'elevation') = 'number'
+                 THEN (point->>'elevation')::float8 ELSE 0.0 END AS elevation,
+            point->>'activity' AS activity,
+            'trajectory' AS source,
+            NULL::int2 AS hour_int
+        FROM trajectories,
+             LATERAL jsonb_array_elements(trajectory) AS point
+        WHERE jsonb_typeof(trajectory) = 'array'
+          AND jsonb_typeof(point) = 'object'
+          AND jsonb_typeof(point->'lat') = 'number'
+          AND jsonb_typeof(point->'lon') = 'number'
+          -- a present but non-numeric speed/elevation (e.g. null) drops the point, as before
+          AND (NOT point ? 'speed' OR jsonb_typeof(point->'speed') = 'number')
+          AND (NOT point ? 'elevation' OR jsonb_typeof(point->'elevation') = 'number')
+    """,
+}
+
+
+def stream_training_vectors(name, query):
     """
-    query = """
-    SELECT jsonb_array_elements(trajectory)::jsonb AS point
-    FROM trajectories
-    WHERE trajectory IS NOT NULL;
+    Run one training-source query through a server-side cursor and build its frame
+    chunk by chunk from tuple rows, so the full result set is never held as Python objects at once.
     """
-    rows = load_from_db(query)
-    if rows.empty:
-        return pd.DataFrame()
-
-    points = []
-    for row in rows.itertuples(index=False):
-        p = row.point
-        try:
-            points.append({
-                "lat": float(p["lat"]),
-                "lon": float(p["lon"]),
-                "speed": float(p.get("speed", 0.0)),
-                "elevation": float(p.get("elevation", 0.0)),
-                "activity": p.get("activity"),
-                "timestamp": p.get("timestamp")
-            })
-        except Exception:
-            continue
-
-    df = pd.DataFrame(points)
-    if df.empty:
-        return df
-
-    # hour in [0,1]
-    df["hour"] = pd.to_datetime(df.get("timestamp"), errors="coerce").dt.hour.fillna(0) / 23.0
-
-    # activity one-hot
-    def _act(a):
-        a = (a if isinstance(a, str) else "").strip().lower()
-        if a in {"walk", "walking", "foot"}:
-            return (1, 0, 0, 0)
-        if a in {"vehicle", "bus", "tram", "train", "car", "bike"}:
-            return (0, 1, 0, 0)
-        if a in {"stationary", "idle", "stop"}:
-            return (0, 0, 1, 0)
-        return (0, 0, 0, 1)
-
-    ohe = df["activity"].apply(_act)
-    df[["act_walk", "act_vehicle", "act_stationary", "act_unknown"]] = pd.DataFrame(ohe.tolist(), index=df.index)
-
-    return df[["lat", "lon", "hour", "speed", "elevation",
-               "act_walk", "act_vehicle", "act_stationary", "act_unknown", "timestamp"]]
+    chunks = []
+    # Named cursors need a transaction; the pool hands out autocommit connections
+    with db_conn() as conn, conn.transaction(), conn.cursor(name=f"training_{name}", row_factory=tuple_row) as cursor:
+        cursor.itersize = TRAINING_VECTORS_ITERSIZE
+        cursor.execute(query)
+        while rows := cursor.fetchmany(TRAINING_VECTORS_ITERSIZE):
+            chunks.append(frame_from_rows(cursor, rows))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
 
 
 def load_training_vectors():
@@ -208,105 +203,67 @@ def load_training_vectors():
       - vehicle_arrivals (GTFS-RT derived)
       - full raw trajectory points (immutable ground truth)
 
+    Sources come back from the queries in TRAINING_VECTORS_QUERIES, fetched in parallel.
+
     Output columns (with time kept for ordering):
       ['lat','lon','hour','speed','elevation','act_walk','act_vehicle','act_stationary','act_unknown','timestamp']
     """
-    queries = {
-        "patterns": """
-            SELECT lat, lon, timestamp
-            FROM user_patterns
-            WHERE lat IS NOT NULL AND lon IS NOT NULL;
-        """,
-        "pois": """
-            SELECT p.lat, p.lon, p.visit_start AS timestamp
-            FROM pois p
-            WHERE p.lat IS NOT NULL AND p.lon IS NOT NULL;
-        """,
-        "pois_sequence": """
-            SELECT predicted_lat AS lat, predicted_lon AS lon, predicted_visit_time AS timestamp
-            FROM predicted_pois_sequence
-            WHERE predicted_lat IS NOT NULL AND predicted_lon IS NOT NULL;
-        """,
-        "astar_mapf": """
-            SELECT origin_lat AS lat, origin_lon AS lon, created_at AS timestamp
-            FROM astar_routes
-            WHERE origin_lat IS NOT NULL AND origin_lon IS NOT NULL
-            UNION
-            SELECT destination_lat AS lat, destination_lon AS lon, created_at AS timestamp
-            FROM mapf_routes
-            WHERE destination_lat IS NOT NULL AND destination_lon IS NOT NULL;
-        """,
-        "gtfs": """
-            SELECT stop_lat AS lat, stop_lon AS lon, NULL::timestamp AS timestamp
-            FROM view_static_gtfs_unified
-            WHERE stop_lat IS NOT NULL AND stop_lon IS NOT NULL;
-        """
-    }
-
-    dfs = []
-
-    # 1) Tabular sources (patterns/pois/astar+mapf/gtfs)
-    for name, query in queries.items():
-        df = load_from_db(query)
-        if df.empty:
-            continue
-
-        # harmonize schema
-        df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
-        df["lon"] = pd.to_numeric(df["lon"], errors="coerce")
-        df = df.dropna(subset=["lat", "lon"])
-
-        # hour in [0,1]
-        df["hour"] = pd.to_datetime(df.get("timestamp"), errors="coerce").dt.hour.fillna(0) / 23.0
-
-        # placeholders for non-trajectory sources
-        df["speed"] = 0.0
-        df["elevation"] = 0.0
-
-        # activity one-hot (unknown for these sources)
-        df["act_walk"] = 0
-        df["act_vehicle"] = 0
-        df["act_stationary"] = 0
-        df["act_unknown"] = 1
-
-        dfs.append(df[["lat", "lon", "hour", "speed", "elevation",
-                       "act_walk", "act_vehicle", "act_stationary", "act_unknown", "timestamp"]])
-
-    # 2) Vehicle arrivals (real-world network behavior)
-    df_arr = load_vehicle_arrivals_for_training()
-    if not df_arr.empty:
-        dfs.append(df_arr)
-
-    # 3) Full raw trajectories (immutable ground truth)
-    df_traj = load_full_trajectory_points()
-    if not df_traj.empty:
-        # coerce
-        for col in ["lat", "lon", "speed", "elevation"]:
-            df_traj[col] = pd.to_numeric(df_traj.get(col), errors="coerce")
-        df_traj = df_traj.dropna(subset=["lat", "lon"])
-        dfs.append(df_traj)
-
-    if not dfs:
+    # Sources stream concurrently, each on its own pooled connection (psycopg waits on I/O without the GIL)
+    with ThreadPoolExecutor(max_workers=len(TRAINING_VECTORS_QUERIES)) as pool:
+        frames = dict(zip(TRAINING_VECTORS_QUERIES,
+                          pool.map(stream_training_vectors, TRAINING_VECTORS_QUERIES, TRAINING_VECTORS_QUERIES.values())))
+
+    # trajectory timestamps arrive as JSON text: parse leniently, then take the hour from the result
+    trajectory = frames["trajectory"]
+    if not trajectory.empty:
+        parsed = pd.to_datetime(trajectory["timestamp"], errors="coerce", utc=True, format="ISO8601")
+        trajectory["timestamp"] = parsed.dt.tz_localize(None)
+        trajectory["hour_int"] = trajectory["timestamp"].dt.hour
+
+    frames = [frame for frame in frames.values() if not frame.empty]
+    df_all = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if df_all.empty:
         logging.warning("⚠ No training vectors available.")
         return pd.DataFrame()
 
-    # Concatenate
-    df_all = pd.concat(dfs, ignore_index=True)
+    for col in ["lat", "lon", "speed", "elevation"]:
+        df_all[col] = pd.to_numeric(df_all[col], errors="coerce")
     df_all = df_all.dropna(subset=["lat", "lon"])
+    trajectory_count = int((df_all["source"] == "trajectory").sum())
+
+    # hour in [0,1], extracted by Postgres (trajectory: by pandas above)
+    df_all["timestamp"] = pd.to_datetime(df_all["timestamp"], errors="coerce")
+    df_all["hour"] = hour_fraction(df_all["hour_int"].fillna(0))
+
+    # only trajectory points carry an activity; the rest land in act_unknown
+    df_all[["act_walk", "act_vehicle", "act_stationary", "act_unknown"]] = activity_one_hot(df_all["activity"])
+
+    df_all = df_all[["lat", "lon", "hour", "speed", "elevation",
+                     "act_walk", "act_vehicle", "act_stationary", "act_unknown", "timestamp"]]
 
     # ✅ Keep temporal order for LSTM
-    df_all["timestamp"] = pd.to_datetime(df_all.get("timestamp"), errors="coerce")
     before = len(df_all)
     df_all = df_all.dropna(subset=["timestamp"]).sort_values("timestamp")
     after = len(df_all)
     logging.info(f"🕒 Kept {after}/{before} rows with valid timestamp for temporal training.")
 
-    # Light dedup to keep memory in check (preserve order)
-    df_all = df_all.drop_duplicates(subset=["lat", "lon", "hour"], keep="first")
+    # Light dedup to keep memory in check (preserve order), on one packed int64 key:
+    # lat/lon quantized to 1e-5 deg (~1 m) and offset to non-negative, hour as 0-23
+    lat_q = np.rint((df_all["lat"].to_numpy() + 90.0) * 1e5).astype(np.int64)  # < 2**25
+    lon_q = np.rint((df_all["lon"].to_numpy() + 180.0) * 1e5).astype(np.int64)  # < 2**26
+    hour_q = np.rint(df_all["hour"].to_numpy() * 23.0).astype(np.int64)  # < 2**5
+    key = (lat_q << 31) | (lon_q << 5) | hour_q
+    df_all = df_all.loc[~pd.Index(key).duplicated(keep="first")]
+
+    # Keras trains in float32 anyway: downcast here so prep and scaling move half the bytes
+    df_all = df_all.astype({
+        "lat": np.float32, "lon": np.float32, "hour": np.float32, "speed": np.float32, "elevation": np.float32,
+        "act_walk": np.int8, "act_vehicle": np.int8, "act_stationary": np.int8, "act_unknown": np.int8,
+    })
 
     logging.info(
         f"✅ Aggregated training vector count: {len(df_all)} "
-        f"(including full trajectories = {len(df_traj) if 'df_traj' in locals() and not df_traj.empty else 0})"
+        f"(including full trajectories = {trajectory_count})"
     )
 
     return df_all
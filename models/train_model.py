@@ -3,8 +3,8 @@ import logging
 import numpy as np
 import joblib
 import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from tensorflow.keras import Sequential
+import tensorflow as tf
+from tensorflow.keras import Sequential, mixed_precision
 from tensorflow.keras.layers import Input, LSTM, Dense
 from tensorflow.keras.callbacks import ModelCheckpoint
 from db.db_connection import load_training_vectors
@@ -22,6 +22,21 @@ EPOCHS = 20
 BATCH_SIZE = 32
 TIME_STEPS = 60
 
+# Compute precision: "auto" picks mixed_float16 when a GPU is visible and plain float32 on CPU,
+# where float16 has no fast path; set mixed_bfloat16 explicitly on CPUs with native bf16 (AMX/AVX512-BF16)
+PRECISION_POLICY = os.getenv("MODELS_PRECISION_POLICY", "auto")
+
+
+def configure_precision():
+    policy = PRECISION_POLICY
+    if policy == "auto":
+        policy = "mixed_float16" if tf.config.list_physical_devices("GPU") else "float32"
+    mixed_precision.set_global_policy(policy)
+    logging.info(f"🧮 Keras precision policy: {policy}")
+
+
+configure_precision()
+
 
 def prepare_lstm_data(df, time_steps=TIME_STEPS):
     if df.empty:
@@ -35,21 +50,25 @@ def prepare_lstm_data(df, time_steps=TIME_STEPS):
 
     # Move labels to the end
     feature_columns = [c for c in df.columns if c not in ["lat", "lon"]] + ["lat", "lon"]
-    df = df[feature_columns]
-
-    X, y = [], []
-    for i in range(time_steps, len(df)):
-        X.append(df.iloc[i - time_steps:i].values)
-        y.append(df.iloc[i][["lat", "lon"]].values)
+    arr = df[feature_columns].to_numpy(dtype=np.float32, copy=False)
 
-    X, y = np.array(X), np.array(y)
-
-    if X.shape[0] == 0:
+    if len(arr) <= time_steps:
         logging.error("❌ Not enough samples after slicing. Try lowering TIME_STEPS.")
         return None, None
 
-    logging.info(f"✅ Prepared LSTM dataset: {X.shape[0]} samples | shape={X.shape[1:]}")
-    return X, y
+    # Window i covers rows [i, i + time_steps) and predicts row i + time_steps (lat/lon are the
+    # last two columns). Windows are cut on the fly per batch, so memory stays O(N·F), not O(N·T·F).
+    dataset = tf.keras.utils.timeseries_dataset_from_array(
+        arr[:-1],
+        targets=arr[time_steps:, -2:],
+        sequence_length=time_steps,
+        batch_size=BATCH_SIZE,
+        shuffle=True,
+        seed=42,
+    ).prefetch(tf.data.AUTOTUNE)
+
+    logging.info(f"✅ Prepared LSTM dataset: {len(arr) - time_steps} samples | shape={(time_steps, arr.shape[1])}")
+    return dataset, arr.shape[1]
 
 
 def build_lstm_model(input_shape):
@@ -59,9 +78,9 @@ def build_lstm_model(input_shape):
         Input(shape=input_shape),
         LSTM(64, activation='relu', return_sequences=True),
         LSTM(50, activation='relu'),
-        Dense(2)  # Output: [lat, lon]
+        Dense(2, dtype='float32')  # Output: [lat, lon], kept float32 under mixed precision
     ])
-    model.compile(optimizer='adam', loss='mse', metrics=['mse'])
+    model.compile(optimizer='adam', loss='mse', metrics=['mse'], jit_compile=True)
 
     logging.info("✅ LSTM model compiled successfully.")
     return model
@@ -82,10 +101,17 @@ def train_unified_model():
         # Drop timestamp from model features
         df = df.drop(columns=["timestamp"])
 
-    # Normalize features (including lat/lon since model predicts in scaled space)
+    # Normalize features (including lat/lon since model predicts in scaled space):
+    # z-score in place on one contiguous float32 block, statistics accumulated in float64
     feature_cols = df.columns.tolist()
-    scaler = StandardScaler()
-    df[feature_cols] = scaler.fit_transform(df[feature_cols])
+    arr = df[feature_cols].to_numpy(dtype=np.float32, copy=True)
+    mean = arr.mean(axis=0, dtype=np.float64).astype(np.float32)
+    std = arr.std(axis=0, dtype=np.float64).astype(np.float32)
+    std[std == 0] = 1.0  # constant columns pass through centred, like StandardScaler
+    arr -= mean
+    arr /= std
+    df = pd.DataFrame(arr, columns=feature_cols, index=df.index)
+    scaler = {"mean": mean, "std": std, "columns": feature_cols}
 
     # Persist scaler + feature order for inference
     try:
@@ -97,11 +123,11 @@ def train_unified_model():
     except Exception as e:
         logging.warning(f"⚠️ Could not save scaler/feature columns: {e}")
 
-    X, y = prepare_lstm_data(df, TIME_STEPS)
-    if X is None:
+    dataset, n_features = prepare_lstm_data(df, TIME_STEPS)
+    if dataset is None:
         return None
 
-    model = build_lstm_model((TIME_STEPS, X.shape[2]))
+    model = build_lstm_model((TIME_STEPS, n_features))
 
     checkpoint_callback = ModelCheckpoint(
         filepath=MODEL_WEIGHTS_PATH,
@@ -110,7 +136,7 @@ def train_unified_model():
         verbose=1
     )
 
-    model.fit(X, y, epochs=EPOCHS, batch_size=BATCH_SIZE, callbacks=[checkpoint_callback])
+    model.fit(dataset, epochs=EPOCHS, callbacks=[checkpoint_callback])
     model.save(MODEL_PATH)
 
     logging.info(f"✅ Model trained and saved to: {MODEL_PATH}")
@@ -1,10 +1,7 @@
-import pandas as pd
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from db.db_connection import load_from_db, save_to_db
+from sklearn.cluster import MiniBatchKMeans
+from db.db_connection import stream_trajectory_points, save_many_to_db
 import logging
-import json
-from shapely.geometry import LineString
 
 logging.basicConfig(level=logging.INFO)
 
@@ -13,44 +10,9 @@ def process_client_clusters(client_id, n_clusters=8):
     """
     Perform clustering on full trajectory history and save result as LineString.
     """
-    query = "SELECT session_id, trajectory FROM trajectories WHERE client_id = %s"
-    data = load_from_db(query, (client_id,))
-
-    if not data:
-        logging.info(f"⚠ No trajectory data found for client_id: {client_id}")
-        return
-
-    trajectory_rows = []
-    for row in data:
-        session_id = row["session_id"]
-        trajectory = row["trajectory"]
-
-        try:
-            if isinstance(trajectory, str):
-                trajectory = json.loads(trajectory)
-            elif not isinstance(trajectory, list):
-                logging.warning(f"⚠ Unexpected format for session {session_id}")
-                continue
-
-            for point in trajectory:
-                if isinstance(point, dict) and "lat" in point and "lon" in point:
-                    point["session_id"] = session_id
-                    trajectory_rows.append(point)
-
-        except (json.JSONDecodeError, TypeError) as e:
-            logging.error(f"❌ Error parsing trajectory for session {session_id}: {e}")
-            continue
-
-    if not trajectory_rows:
-        logging.info(f"⚠ No valid trajectory data to process for client_id: {client_id}")
-        return
-
-    df = pd.DataFrame(trajectory_rows)
-    df["lat"] = df["lat"].astype(float)
-    df["lon"] = df["lon"].astype(float)
-
+    df = stream_trajectory_points(client_id)
     if df.empty:
-        logging.warning(f"⚠ No usable points for clustering for client_id: {client_id}")
+        logging.info(f"⚠ No valid trajectory data to process for client_id: {client_id}")
         return
 
     logging.info(f"✅ {len(df)} points loaded for clustering for client_id: {client_id}")
@@ -60,7 +22,9 @@ def process_client_clusters(client_id, n_clusters=8):
     scaler = StandardScaler()
     scaled = scaler.fit_transform(coords)
 
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+    # Mini-batches keep each iteration at batch_size points instead of the client's full history;
+    # 2D lat/lon converges well without ten restarts
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=min(4096, len(scaled)), n_init=3, random_state=42)
     df["cluster"] = kmeans.fit_predict(scaled)
 
     cluster_centers = kmeans.cluster_centers_
@@ -68,19 +32,20 @@ def process_client_clusters(client_id, n_clusters=8):
 
     logging.info(f"✅ Cluster centers for {client_id}: {real_centers}")
 
-    for idx in sorted(df["cluster"].unique()):
-        cluster_df = df[df["cluster"] == idx].sort_values("timestamp")
+    pattern_rows = []
+    # One stable sort by time, then groupby keeps that order inside each cluster
+    for idx, cluster_df in df.sort_values("timestamp", kind="mergesort").groupby("cluster", sort=True):
         if len(cluster_df) < 2:
             continue  # skip single-point clusters
 
-        line = LineString(zip(cluster_df["lon"], cluster_df["lat"]))
+        # Pattern point is the fitted cluster center; the ordered points only feed the WKT
+        center_lat, center_lon = real_centers[idx]
+        line_wkt = "LINESTRING(" + ",".join(
+            f"{lon} {lat}" for lon, lat in zip(cluster_df["lon"].to_numpy(), cluster_df["lat"].to_numpy())
+        ) + ")"
+        pattern_rows.append((client_id, float(center_lat), float(center_lon), f"Cluster {idx + 1}", line_wkt))
 
-        save_to_db("user_patterns", {
-            "client_id": client_id,
-            "lat": line.centroid.y,
-            "lon": line.centroid.x,
-            "pattern_type": f"Cluster {idx + 1}",
-            "geom": line.wkt
-        })
+    # One executemany for every cluster instead of an INSERT per cluster
+    save_many_to_db("user_patterns", ("client_id", "lat", "lon", "pattern_type", "geom"), pattern_rows)
 
     logging.info(f"✅ Clustering results saved for client_id: {client_id}")
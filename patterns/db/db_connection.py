@@ -1,7 +1,9 @@
 import logging
-import time
 import psycopg
-from psycopg.rows import dict_row
+from psycopg.rows import dict_row, tuple_row
+from psycopg import sql
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import os
 import json
@@ -11,38 +13,35 @@ from shapely.wkb import loads
 
 load_dotenv()
 
-db_connection = None
-
-
-def get_db_connection(retries=5, delay=5):
-    global db_connection
-    if db_connection is not None:
-        return db_connection
-
-    for attempt in range(retries):
-        try:
-            db_connection = psycopg.connect(
-                dbname=os.getenv('POSTGRES_DB'),
-                user=os.getenv('POSTGRES_USER'),
-                password=os.getenv('POSTGRES_PASSWORD'),
-                host=os.getenv('POSTGRES_HOST'),
-                port=os.getenv('POSTGRES_PORT'),
-                autocommit=True,
-                row_factory=dict_row
-            )
-            logging.info("✅ Successfully connected to the database.")
-            return db_connection
-        except psycopg.OperationalError as e:
-            logging.warning(f"⚠️ Attempt {attempt + 1}/{retries} failed: {e}")
-            time.sleep(delay)
-    raise Exception("❌ Failed to connect to the database after multiple attempts")
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
+
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
 
 
 def load_from_db(query, conditions=None):
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(query, conditions or ())
+        with db_conn() as conn, conn.cursor() as cursor:
+            cursor.execute(query, conditions or (), prepare=True)
             result = cursor.fetchall()
             if not result:
                 logging.warning("⚠ No data found for query: %s", query)
@@ -52,60 +51,93 @@ def load_from_db(query, conditions=None):
         return None
 
 
-def save_to_db(table, data):
+_insert_statements = {}
+
+
+def insert_statement(table, columns, placeholders):
+    """
+    Composed INSERT for `table`, built once per (table, columns, placeholders) shape and reused.
+    `placeholders` holds one SQL fragment per column, e.g. "%s" or "ST_GeomFromText(%s, 4326)".
     """
-    Save data to the specified table. Handles PostGIS geometry ('geom') if present.
+    key = (table, columns, placeholders)
+    statement = _insert_statements.get(key)
+    if statement is None:
+        statement = sql.SQL("INSERT INTO {} ({}) VALUES ({}) ON CONFLICT DO NOTHING").format(
+            sql.Identifier(table),
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.SQL(", ").join(map(sql.SQL, placeholders)),
+        )
+        _insert_statements[key] = statement
+    return statement
+
+
+def save_many_to_db(table, columns, rows, geom_col="geom"):
     """
-    if not isinstance(data, dict) or not data:
-        logging.error("❌ Data must be a non-empty dictionary to save to the database.")
+    Insert many rows into `table` with one statement, run through executemany.
+    `geom_col` values are WKT and go through ST_GeomFromText(%s, 4326).
+    """
+    rows = list(rows)
+    if not rows:
         return
 
-    conn = get_db_connection()
+    columns = tuple(columns)
+    placeholders = tuple("ST_GeomFromText(%s, 4326)" if column == geom_col else "%s" for column in columns)
     try:
-        with conn.cursor() as cursor:
-            columns = []
-            placeholders = []
-            values = []
-
-            for key, value in data.items():
-                if key == "geom":
-                    if isinstance(value, dict) and "lat" in value and "lon" in value:
-                        columns.append("geom")
-                        placeholders.append("ST_SetSRID(ST_MakePoint(%s, %s), 4326)")
-                        values.extend([value["lon"], value["lat"]])
-                    elif isinstance(value, str) and value.upper().startswith("LINESTRING"):
-                        columns.append("geom")
-                        placeholders.append("ST_GeomFromText(%s, 4326)")
-                        values.append(value)
-                else:
-                    columns.append(key)
-                    placeholders.append("%s")
-                    values.append(value)
-
-            query = f"""
-                INSERT INTO {table} ({', '.join(columns)})
-                VALUES ({', '.join(placeholders)})
-                ON CONFLICT DO NOTHING
-            """
-            cursor.execute(query, tuple(values))
-            logging.info(f"✅ Data saved to table '{table}'.")
-
+        with db_conn() as conn, conn.cursor() as cursor:
+            cursor.executemany(insert_statement(table, columns, placeholders), rows)
+            logging.info(f"✅ {len(rows)} row(s) saved to table '{table}'.")
     except psycopg.Error as e:
         logging.error(f"❌ Error saving to table {table}, Error: {e}")
 
 
+TRAJECTORY_ITERSIZE = int(os.getenv("PATTERNS_TRAJECTORY_ITERSIZE", "50000"))
+
+
+def stream_trajectory_points(client_id):
+    """
+    Every trajectory point for a client as a DataFrame (session_id, lat, lon, timestamp).
+    Points are unpacked from JSONB in Postgres and streamed through a server-side cursor,
+    so no trajectory document is parsed in Python.
+    """
+    query = """
+    SELECT t.session_id,
+           (p->>'lat')::float8 AS lat,
+           (p->>'lon')::float8 AS lon,
+           p->>'timestamp' AS timestamp
+    FROM trajectories t,
+         LATERAL jsonb_array_elements(t.trajectory) AS p
+    WHERE t.client_id = %s
+      AND jsonb_typeof(t.trajectory) = 'array'
+      AND jsonb_typeof(p) = 'object'
+      AND p ? 'lat' AND p ? 'lon';
+    """
+    chunks = []
+    try:
+        # Named cursors need a transaction; the pool hands out autocommit connections
+        with db_conn() as conn, conn.transaction(), \
+                conn.cursor(name="trajectory_points", row_factory=tuple_row) as cursor:
+            cursor.itersize = TRAJECTORY_ITERSIZE
+            cursor.execute(query, (client_id,))
+            columns = [column.name for column in cursor.description]
+            while rows := cursor.fetchmany(TRAJECTORY_ITERSIZE):
+                chunks.append(pd.DataFrame.from_records(rows, columns=columns))
+    except psycopg.Error as e:
+        logging.error(f"❌ Error streaming trajectory points for client_id: {client_id}, Error: {e}")
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
 def load_trajectories(client_id):
     """
     Load all trajectories for a specific client_id and return as GeoDataFrame.
     """
-    conn = get_db_connection()
     query = """
     SELECT session_id, trajectory
     FROM trajectories
     WHERE client_id = %s
     """
     try:
-        with conn.cursor() as cursor:
+        with db_conn() as conn, conn.cursor() as cursor:
             cursor.execute(query, (client_id,))
             result = cursor.fetchall()
 
@@ -1,9 +1,15 @@
+import os
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from db.db_connection import load_from_db
 import client_clusters
 
 logging.basicConfig(level=logging.INFO)
 
+# Clients are clustered independently, one per worker process
+PATTERNS_WORKERS = int(os.getenv("PATTERNS_WORKERS", str(os.cpu_count() or 1)))
+
 
 def get_all_clients():
     """
@@ -43,8 +49,11 @@ def main():
         logging.info("⚠ No client data found. Exiting.")
         return
 
-    for client_id in client_ids:
-        process_client_data(client_id)
+    # Spawned (not forked) workers import db_connection afresh and open their own pool,
+    # instead of inheriting the parent's pooled sockets
+    with ProcessPoolExecutor(max_workers=PATTERNS_WORKERS,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        list(pool.map(process_client_data, client_ids, chunksize=4))
 
     logging.info("✅ Completed clustering for all clients.")
 
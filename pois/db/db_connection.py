@@ -1,56 +1,47 @@
-import json
 import logging
-import time
 import numpy as np
 import pandas as pd
 import psycopg
 import os
 from dotenv import load_dotenv
-from psycopg.rows import dict_row
-from psycopg.sql import SQL, Identifier
-from sklearn.cluster import DBSCAN
+from psycopg.rows import dict_row, tuple_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
 
 # Load environment variables
 load_dotenv()
 
-# Global variable for storing the database connection
-db_connection = None
-
-
-def get_db_connection(retries=5, delay=5):
-    """
-    Establish and return a PostgreSQL database connection with retry logic.
-    """
-    global db_connection
-    if db_connection is not None and not db_connection.closed:
-        return db_connection
-
-    for attempt in range(retries):
-        try:
-            db_connection = psycopg.connect(
-                dbname=os.getenv('POSTGRES_DB'),
-                user=os.getenv('POSTGRES_USER'),
-                password=os.getenv('POSTGRES_PASSWORD'),
-                host=os.getenv('POSTGRES_HOST'),
-                port=os.getenv('POSTGRES_PORT', '5432'),  # ✅ Default to 5432 if not set
-                autocommit=True,
-                row_factory=dict_row
-            )
-            logging.info("✅ Successfully connected to the database.")
-            return db_connection
-        except psycopg.OperationalError as e:
-            logging.warning(f"⚠ Attempt {attempt + 1}/{retries} failed: {e}")
-            time.sleep(delay)
-    raise Exception("❌ Failed to connect to the database after multiple attempts")
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
+
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
 
 
 def load_from_db(query, conditions=None):
     """
     Load data from the database using a given query and optional conditions.
     """
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
+        with db_conn() as conn, conn.cursor() as cursor:
             if conditions:
                 cursor.execute(query, conditions)
             else:
@@ -64,43 +55,6 @@ def load_from_db(query, conditions=None):
         return None
 
 
-def save_to_db(table, data):
-    """
-    Save data to the specified table. Handles PostGIS geometry ('geom') if present.
-    """
-    if not isinstance(data, dict) or not data:
-        logging.error("❌ Data must be a non-empty dictionary to save to the database.")
-        return
-
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            columns = []
-            placeholders = []
-            values = []
-
-            for key, value in data.items():
-                if key == "geom" and isinstance(value, dict) and "lat" in value and "lon" in value:
-                    columns.append("geom")
-                    placeholders.append("ST_SetSRID(ST_MakePoint(%s, %s), 4326)")
-                    values.extend([value["lon"], value["lat"]])
-                else:
-                    columns.append(key)
-                    placeholders.append("%s")
-                    values.append(value)
-
-            query = f"""
-                INSERT INTO {table} ({', '.join(columns)})
-                VALUES ({', '.join(placeholders)})
-                ON CONFLICT DO NOTHING
-            """
-            cursor.execute(query, tuple(values))
-            logging.info(f"✅ Data saved to table '{table}'.")
-
-    except psycopg.Error as e:
-        logging.error(f"❌ Error saving to table {table}, Error: {e}")
-
-
 def fetch_trajectory_clients():
     """
     Fetch distinct client_ids that have data in the `trajectories` table.
@@ -122,102 +76,133 @@ def fetch_client_poi_count(client_id):
     return result[0]["count"] if result else 0
 
 
-def save_pois_to_db(pois_df):
-    for _, row in pois_df.iterrows():
-        if any(pd.isna(row[col]) for col in ['client_id', 'lat', 'lon', 'time_spent', 'poi_rank']):
-            logging.error(f"Skipping invalid POI row: {row}")
-            continue
+def upsert_pois_with_arrivals(client_id, pois_df, match_radius_m):
+    """
+    Save detected visits and record their arrivals in one MERGE.
+    Visits are COPYed into a transaction-scoped staging table and folded per (lat, lon) in SQL.
+    Each place is matched to the client's nearest existing POI within match_radius_m (cluster
+    centroids drift as visits come and go, so exact coordinates would spawn near-duplicates):
+    a known POI gets visit_count += distinct arrivals and the latest visit_start; an unknown place is
+    inserted with those values, its longest visit as time_spent and its earliest visit as created_at.
+    """
+    required = ['client_id', 'lat', 'lon', 'time_spent', 'poi_rank']
+    invalid = pois_df[required].isna().any(axis=1).to_numpy()
+    if invalid.any():
+        logging.error(f"Skipping {int(invalid.sum())} invalid POI row(s)")
+    valid = pois_df[~invalid]
+    if valid.empty:
+        return
 
-        data = {
-            'client_id': row['client_id'],
-            'lat': row['lat'],
-            'lon': row['lon'],
-            'geom': {"lat": row['lat'], "lon": row['lon']},
-            'time_spent': row['time_spent'],
-            'poi_rank': row['poi_rank'],
-            'created_at': row['poi_created_at'] if 'poi_created_at' in row and pd.notnull(
-                row['poi_created_at']) else pd.Timestamp.now()
-        }
+    now = pd.Timestamp.now(tz="UTC")
+    created_at = valid['poi_created_at'].where(valid['poi_created_at'].notna(), now)
+    rows = zip(
+        valid['lat'].tolist(), valid['lon'].tolist(),
+        valid['time_spent'].tolist(), valid['poi_rank'].tolist(),
+        valid['visit_start'].tolist(), created_at.tolist(),
+    )
 
-        try:
-            save_to_db('pois', data)
-            logging.info(f"✅ Saved POI: {data}")
-        except Exception as e:
-            logging.error(f"❌ Error saving POI data: {e}")
+    try:
+        with db_conn() as conn, conn.transaction(), conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE poi_visits_stage (
+                    lat FLOAT,
+                    lon FLOAT,
+                    time_spent FLOAT,
+                    poi_rank FLOAT,
+                    visit_start TIMESTAMPTZ,
+                    created_at TIMESTAMPTZ
+                ) ON COMMIT DROP
+            """)
+            with cursor.copy(
+                "COPY poi_visits_stage (lat, lon, time_spent, poi_rank, visit_start, created_at) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    copy.write_row(row)
+            cursor.execute("""
+                MERGE INTO pois p
+                USING (
+                    -- places snapped onto the same existing POI are combined, so no POI is hit twice
+                    SELECT poi_id, MIN(lat) AS lat, MIN(lon) AS lon,
+                           SUM(arrivals) AS arrivals,
+                           MAX(visit_start) AS visit_start,
+                           MAX(time_spent) AS time_spent,
+                           MAX(poi_rank) AS poi_rank,
+                           MIN(created_at) AS created_at
+                    FROM (
+                        SELECT f.*, near.poi_id
+                        FROM (
+                            SELECT lat, lon,
+                                   COUNT(DISTINCT visit_start) AS arrivals,
+                                   MAX(visit_start) AS visit_start,
+                                   MAX(time_spent) AS time_spent,
+                                   MAX(poi_rank) AS poi_rank,
+                                   MIN(created_at) AS created_at
+                            FROM poi_visits_stage
+                            GROUP BY lat, lon
+                        ) f
+                        LEFT JOIN LATERAL (
+                            SELECT e.poi_id
+                            FROM pois e
+                            WHERE e.client_id = %(client_id)s
+                              AND ST_DWithin(e.geom::geography, ST_MakePoint(f.lon, f.lat)::geography, %(radius_m)s)
+                            ORDER BY ST_Distance(e.geom::geography, ST_MakePoint(f.lon, f.lat)::geography)
+                            LIMIT 1
+                        ) near ON TRUE
+                    ) snapped
+                    GROUP BY poi_id,
+                             CASE WHEN poi_id IS NULL THEN lat END,
+                             CASE WHEN poi_id IS NULL THEN lon END
+                ) src
+                ON p.poi_id = src.poi_id
+                WHEN MATCHED THEN UPDATE SET
+                    visit_count = COALESCE(p.visit_count, 0) + src.arrivals,
+                    visit_start = GREATEST(COALESCE(p.visit_start, to_timestamp(0)::timestamp), src.visit_start)
+                WHEN NOT MATCHED THEN INSERT
+                    (client_id, lat, lon, geom, time_spent, poi_rank, visit_start, visit_count, created_at)
+                VALUES
+                    (%(client_id)s, src.lat, src.lon, ST_SetSRID(ST_MakePoint(src.lon, src.lat), 4326),
+                     src.time_spent, src.poi_rank, src.visit_start, src.arrivals, src.created_at)
+            """, {"client_id": client_id, "radius_m": match_radius_m})
+            logging.info(f"✅ Merged {cursor.rowcount} POI(s) for client_id {client_id}.")
+    except psycopg.Error as e:
+        logging.error(f"❌ Error merging POI data for client_id {client_id}: {e}")
 
 
 def load_client_trajectories(client_id):
     """
-    Load and unpack all trajectories for a specific client_id using Python-side JSON decoding.
+    Load all trajectory points for a specific client_id as one flat DataFrame.
+    Points are unpacked from JSONB and typed inside Postgres, so Python never decodes trajectory JSON.
     """
     query = """
-        SELECT session_id, trajectory
-        FROM trajectories
-        WHERE client_id = %s
+        SELECT
+            t.session_id,
+            (elem->>'lat')::float8 AS lat,
+            (elem->>'lon')::float8 AS lon,
+            CASE WHEN elem->>'timestamp' ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}'
+                 THEN (elem->>'timestamp')::timestamptz END AS timestamp,
+            (elem->>'speed')::float8 AS speed
+        FROM trajectories t,
+             LATERAL jsonb_array_elements(t.trajectory) AS elem
+        WHERE t.client_id = %s
+          AND jsonb_typeof(t.trajectory) = 'array'
+          AND elem ? 'lat' AND elem ? 'lon'
         """
 
-    result = load_from_db(query, (client_id,))
-    if not result:
-        logging.warning(f"⚠ No trajectory data found for client_id {client_id}.")
+    try:
+        with db_conn() as conn, conn.cursor(row_factory=tuple_row) as cursor:
+            cursor.execute(query, (client_id,))
+            columns = [column.name for column in cursor.description]
+            df = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+    except psycopg.Error as e:
+        logging.error(f"❌ Error loading trajectories for client_id {client_id}: {e}")
         return pd.DataFrame()
 
-    all_trajectories = []
-
-    for row in result:
-        session_id = row.get("session_id")
-        trajectory = row.get("trajectory")
-
-        # Ensure proper JSON list decoding
-        if isinstance(trajectory, str):
-            try:
-                trajectory = json.loads(trajectory)
-            except json.JSONDecodeError:
-                logging.error(f"❌ Invalid JSON format for client {client_id} in session {session_id}")
-                continue
-
-        if isinstance(trajectory, list):
-            df = pd.DataFrame(trajectory)
-            if {'lat', 'lon', 'timestamp', 'speed'}.issubset(df.columns):
-                df["client_id"] = client_id
-                df["session_id"] = session_id
-                all_trajectories.append(df)
-            else:
-                logging.warning(f"⚠ Missing required fields in session {session_id}")
-        else:
-            logging.warning(f"⚠ Non-list trajectory in session {session_id}")
-
-    if not all_trajectories:
+    if df.empty:
         logging.warning(f"⚠ No valid trajectory records for client_id: {client_id}")
         return pd.DataFrame()
 
-    df = pd.concat(all_trajectories, ignore_index=True)
-    df["lat"] = df["lat"].astype(float)
-    df["lon"] = df["lon"].astype(float)
-    df["speed"] = df["speed"].astype(float)
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    df["client_id"] = client_id
+    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce", utc=True)
 
     logging.info(f"✅ Loaded {len(df)} trajectory points for client_id: {client_id}")
     return df
-
-
-def update_poi_arrival(client_id: str, lat: float, lon: float, visit_start):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                UPDATE pois
-                SET
-                  visit_count = COALESCE(visit_count, 0) + 1,
-                  visit_start = GREATEST(COALESCE(visit_start, to_timestamp(0)::timestamp), %s)
-                WHERE client_id = %s AND lat = %s AND lon = %s
-                """,
-                (visit_start, client_id, lat, lon)
-            )
-            if cursor.rowcount == 0:
-                logging.warning(
-                    "⚠ No matching POI for arrival update (client_id=%s, lat=%s, lon=%s)",
-                    client_id, lat, lon
-                )
-    except psycopg.Error as e:
-        logging.error(f"❌ update_poi_arrival failed: {e}")
@@ -1,10 +1,15 @@
+import os
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from db.db_connection import fetch_trajectory_clients
 from poi_op import process_client_pois
 
 logging.basicConfig(level=logging.INFO)
 
+# POI detection is CPU-bound (NumPy/DBSCAN): one client per worker process
+POIS_WORKERS = int(os.getenv("POIS_WORKERS", str(os.cpu_count() or 1)))
+
 
 def process_client(client_id):
     """
@@ -25,10 +30,13 @@ def main():
         logging.warning("⚠ No active clients found in geodata. Aborting.")
         return
 
-    max_workers = min(len(client_ids), 50)
+    max_workers = min(len(client_ids), POIS_WORKERS)
 
     try:
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Spawned (not forked) workers import db_connection afresh and open their own pool,
+        # instead of inheriting the parent's pooled sockets
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
             futures = {
                 executor.submit(process_client, client_id): client_id
                 for client_id in client_ids
@@ -38,7 +46,7 @@ def main():
                 try:
                     future.result()
                 except Exception as e:
-                    logging.error(f"❌ Thread error for client {futures[future]}: {e}")
+                    logging.error(f"❌ Worker error for client {futures[future]}: {e}")
 
         logging.info("✅ Finished POI detection for all clients.")
     except Exception as e:
@@ -1,17 +1,69 @@
+import os
 import logging
 import numpy as np
 import pandas as pd
 from datetime import datetime
 from shapely.geometry import Point
-from db.db_connection import (
-    save_pois_to_db,
-    load_client_trajectories,
-    update_poi_arrival,
-)
+from sklearn.cluster import DBSCAN
+from numba import njit
+
+# Optional GPU DBSCAN; only present on CUDA images with RAPIDS installed
+try:
+    from cuml.cluster import DBSCAN as GPU_DBSCAN
+except ImportError:
+    GPU_DBSCAN = None
+from db.db_connection import load_client_trajectories, upsert_pois_with_arrivals
 
 
 logging.basicConfig(level=logging.INFO)
 
+EARTH_RADIUS_M = 6_371_000
+POI_CLUSTER_RADIUS_M = float(os.getenv("POI_CLUSTER_RADIUS_M", "50"))
+POI_CLUSTER_MIN_SAMPLES = int(os.getenv("POI_CLUSTER_MIN_SAMPLES", "3"))
+# Below this many candidates the host<->device copy costs more than the GPU saves
+POI_GPU_MIN_POINTS = int(os.getenv("POI_GPU_MIN_POINTS", "10000"))
+
+
+@njit(cache=True)
+def scan_dwell_candidates(ts_ns, sid, speed, min_time_s, speed_threshold):
+    """
+    One pass over points sorted by (session, time): dwell is the gap to the next point of
+    the same session (0 for a session's last point). A point is a candidate when it dwells
+    longer than min_time_s or moves slower than speed_threshold.
+    Returns (candidate indices, their dwell in seconds).
+    """
+    n = ts_ns.shape[0]
+    idx = np.empty(n, dtype=np.int64)
+    dwell = np.empty(n, dtype=np.float64)
+    k = 0
+    for i in range(n):
+        spent = 0.0
+        if i + 1 < n and sid[i + 1] == sid[i]:
+            spent = (ts_ns[i + 1] - ts_ns[i]) / 1e9
+        if spent > min_time_s or speed[i] < speed_threshold:
+            idx[k] = i
+            dwell[k] = spent
+            k += 1
+    return idx[:k], dwell[:k]
+
+
+def cluster_visits(lat, lon):
+    """
+    DBSCAN labels for visit candidates within POI_CLUSTER_RADIUS_M of each other (-1 = noise).
+    cuML has no haversine metric, so on GPU points become unit vectors on the sphere and are
+    clustered by chord length 2*sin(d/2), which orders pairs exactly like the great-circle distance d.
+    """
+    eps = POI_CLUSTER_RADIUS_M / EARTH_RADIUS_M
+    if GPU_DBSCAN is not None and lat.size >= POI_GPU_MIN_POINTS:
+        phi, lam = np.radians(lat), np.radians(lon)
+        xyz = np.column_stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+        labels = GPU_DBSCAN(eps=2 * np.sin(eps / 2), min_samples=POI_CLUSTER_MIN_SAMPLES,
+                            output_type='numpy').fit_predict(xyz)
+        return np.asarray(labels, dtype=np.int64)
+
+    return DBSCAN(eps=eps, min_samples=POI_CLUSTER_MIN_SAMPLES,
+                  metric='haversine', algorithm='ball_tree').fit_predict(np.radians(np.column_stack((lat, lon))))
+
 
 def detect_pois(client_data, min_time=590, speed_threshold=1.0):
     """
@@ -22,40 +74,68 @@ def detect_pois(client_data, min_time=590, speed_threshold=1.0):
     if not isinstance(client_data, pd.DataFrame):
         raise TypeError("Input to detect_pois must be a pandas DataFrame")
 
-    client_data['timestamp'] = pd.to_datetime(client_data['timestamp'], errors='coerce')
+    cols = [
+        'client_id', 'lat', 'lon', 'time_spent', 'poi_rank', 'poi_created_at',
+        'visit_start', 'visit_end', 'duration_seconds'
+    ]
+
+    # load_client_trajectories already hands back datetimes: only parse when given raw values
+    if not pd.api.types.is_datetime64_any_dtype(client_data['timestamp']):
+        client_data['timestamp'] = pd.to_datetime(client_data['timestamp'], errors='coerce', utc=True)
     client_data = client_data.dropna(subset=['timestamp'])
     client_data = client_data.sort_values(['session_id', 'timestamp'])
 
-    # next_time within session
-    client_data['next_time'] = client_data.groupby('session_id')['timestamp'].shift(-1)
-    client_data['time_spent'] = (client_data['next_time'] - client_data['timestamp']).dt.total_seconds().fillna(0)
+    # Work on flat arrays: int64 ns offsets (tz-safe) and integer session codes, in (session, time) order
+    timestamps = client_data['timestamp']
+    ts = (timestamps - timestamps.min()).to_numpy(dtype='timedelta64[ns]').view('i8')
+    sid = pd.factorize(client_data['session_id'])[0].astype(np.int64)
+    lat = client_data['lat'].to_numpy(dtype=np.float64)
+    lon = client_data['lon'].to_numpy(dtype=np.float64)
+    speed = pd.to_numeric(client_data['speed'], errors='coerce').to_numpy(dtype=np.float64)
 
-    # Candidate visits: dwell long enough OR moving slow
-    candidates = client_data[
-        (client_data['time_spent'] > min_time) | (client_data['speed'] < speed_threshold)
-        ].copy()
+    idx, cand_time = scan_dwell_candidates(ts, sid, speed, float(min_time), float(speed_threshold))
 
-    if candidates.empty:
+    if idx.size == 0:
         logging.info("⚠ No POI candidates found.")
-        return pd.DataFrame(columns=[
-            'client_id', 'lat', 'lon', 'time_spent', 'poi_rank', 'poi_created_at',
-            'visit_start', 'visit_end', 'duration_seconds'
-        ])
-
-    # Treat each candidate row as a visit event (you can later coalesce by proximity if you want)
-    candidates['poi_rank'] = candidates.groupby(['lat', 'lon'])['time_spent'].transform('sum')
-    candidates['client_id'] = client_data['client_id'].iloc[0]
+        return pd.DataFrame(columns=cols)
+
+    # Each candidate row is a visit event. Visits are coalesced by proximity: DBSCAN groups
+    # candidates within POI_CLUSTER_RADIUS_M and those visits take the cluster centroid as
+    # their (lat, lon); noise points keep their own exact location.
+    cand_lat, cand_lon = lat[idx], lon[idx]
+    labels = cluster_visits(cand_lat, cand_lon)
+    clustered = labels >= 0
+    n_clusters = labels.max() + 1
+    if n_clusters > 0:
+        counts = np.bincount(labels[clustered], minlength=n_clusters)
+        cand_lat = cand_lat.copy()
+        cand_lon = cand_lon.copy()
+        cand_lat[clustered] = (np.bincount(labels[clustered], weights=cand_lat[clustered]) / counts)[labels[clustered]]
+        cand_lon[clustered] = (np.bincount(labels[clustered], weights=cand_lon[clustered]) / counts)[labels[clustered]]
+
+    # poi_rank is the total dwell over every visit sharing the same (lat, lon) after coalescing.
+    # (lat, lon) at 1e-6° is packed into one uint64 key, so grouping is a 1-D integer unique
+    # instead of a row-wise unique over a 2-column float array
+    place_key = (np.rint(cand_lat * 1e6 + 90e6).astype(np.uint64) << np.uint64(32)) \
+        | np.rint(cand_lon * 1e6 + 180e6).astype(np.uint64)
+    _, place = np.unique(place_key, return_inverse=True)
+    place = place.reshape(-1)
+    poi_rank = np.bincount(place, weights=cand_time)[place]
 
     # per-visit timing
-    candidates['visit_start'] = candidates['timestamp']
-    candidates['visit_end'] = candidates['timestamp'] + pd.to_timedelta(candidates['time_spent'], unit='s')
-    candidates['duration_seconds'] = candidates['time_spent'].astype('int64', errors='ignore')
-    candidates['poi_created_at'] = candidates['timestamp']
+    visit_start = timestamps.iloc[idx].reset_index(drop=True)
+    candidates = pd.DataFrame({
+        'client_id': client_data['client_id'].iloc[0],
+        'lat': cand_lat,
+        'lon': cand_lon,
+        'time_spent': cand_time,
+        'poi_rank': poi_rank,
+        'poi_created_at': visit_start,
+        'visit_start': visit_start,
+        'visit_end': visit_start + pd.to_timedelta(cand_time, unit='s'),
+        'duration_seconds': cand_time.astype(np.int64),
+    })
 
-    cols = [
-        'client_id', 'lat', 'lon', 'time_spent', 'poi_rank', 'poi_created_at',
-        'visit_start', 'visit_end', 'duration_seconds'
-    ]
     out = candidates[cols].drop_duplicates()
     logging.info(f"✅ POI detection finished: {len(out)} visits for client_id {out['client_id'].iloc[0]}")
     return out
@@ -72,12 +152,8 @@ def process_client_pois(client_id):
         logging.warning(f"⚠ No POIs detected for client_id: {client_id}")
         return
 
-    # Existing behavior: persist detected POIs
-    save_pois_to_db(pois_df)
-
-    # NEW: record an arrival for each visit (dedupe by lat, lon, visit_start)
-    arrivals = pois_df[['lat', 'lon', 'visit_start']].drop_duplicates()
-    for _, r in arrivals.iterrows():
-        update_poi_arrival(client_id, float(r.lat), float(r.lon), r.visit_start)
+    # One MERGE both saves new POIs and records an arrival per distinct visit;
+    # places within the clustering radius of a known POI count towards that POI
+    upsert_pois_with_arrivals(client_id, pois_df, POI_CLUSTER_RADIUS_M)
 
-    logging.info(f"✅ Saved {len(pois_df)} POIs + recorded {len(arrivals)} arrivals for client_id: {client_id}")
+    logging.info(f"✅ Processed {len(pois_df)} POI visits for client_id: {client_id}")
@@ -394,9 +394,11 @@ CREATE INDEX IF NOT EXISTS "trajectories_created_idx" ON "trajectories" ("create
 CREATE INDEX IF NOT EXISTS "optimized_routes_segment_idx" ON "optimized_routes" ("segment_type");
 CREATE INDEX IF NOT EXISTS "reroutes_segment_idx" ON "reroutes" ("segment_type");
 CREATE INDEX IF NOT EXISTS "geodata_client_time_idx" ON "geodata" ("client_id","timestamp" DESC, "updated_at" DESC);
+CREATE INDEX IF NOT EXISTS "geodata_client_updated_idx" ON "geodata" ("client_id", "updated_at" DESC);
 CREATE INDEX IF NOT EXISTS "mqtt_sessions_client_bounds_idx" ON "mqtt_sessions" ("client_id","start_time","end_time");
 CREATE INDEX IF NOT EXISTS "optimized_routes_client_time_idx" ON "optimized_routes" ("client_id","created_at" DESC);
 CREATE INDEX IF NOT EXISTS "reroutes_client_time_idx" ON "reroutes" ("client_id","created_at" DESC);
+CREATE INDEX IF NOT EXISTS "gtfs_stops_geom_idx" ON "gtfs_stops" USING GIST ("geom");
 
 
 CREATE OR REPLACE VIEW "view_routing_candidates_gtfsrt" AS
@@ -473,6 +475,23 @@ WHERE last_ts >= NOW() - INTERVAL '26 hours'
    OR last_seen >= NOW() - INTERVAL '2 seconds';
 
 
+-- Wake LISTENers (mapf) with the client_ids that just received geodata, one NOTIFY per client per statement
+CREATE OR REPLACE FUNCTION notify_active_clients_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('active_clients_changed', changed.client_id)
+    FROM (SELECT DISTINCT client_id FROM new_rows) changed;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS "geodata_active_clients_notify" ON "geodata";
+CREATE TRIGGER "geodata_active_clients_notify"
+    AFTER INSERT ON "geodata"
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+EXECUTE FUNCTION notify_active_clients_changed();
+
+
 CREATE OR REPLACE VIEW "view_current_session_id_from_geodata" AS
 SELECT DISTINCT ON (g."client_id")
     g."client_id",
@@ -1046,3 +1065,45 @@ FROM (
      ) q
 WHERE rn = 1;
 
+
+
+-- Materialized copies of the hot per-cycle views (refreshed CONCURRENTLY by the retention janitor)
+CREATE MATERIALIZED VIEW IF NOT EXISTS "mv_combined_pois" AS
+SELECT
+    'stable:' || p.poi_id AS source_key,
+    p.client_id,
+    p.lat,
+    p.lon,
+    p.poi_rank,
+    NULL::FLOAT AS time_spent,
+    p.geom,
+    'stable' AS poi_type,
+    p.created_at,
+    NULL::timestamp AS predicted_visit_time
+FROM pois p
+UNION ALL
+SELECT
+    'predicted:' || s.id AS source_key,
+    s.client_id,
+    s.predicted_lat  AS lat,
+    s.predicted_lon  AS lon,
+    0.5              AS poi_rank,
+    NULL::FLOAT      AS time_spent,
+    s.geom,
+    ('predicted_' || s.prediction_type) AS poi_type,
+    s.created_at,
+    s.predicted_visit_time
+FROM predicted_pois_sequence s
+WITH DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS "mv_combined_pois_key_idx" ON "mv_combined_pois" ("source_key");
+CREATE INDEX IF NOT EXISTS "mv_combined_pois_client_rank_idx"
+    ON "mv_combined_pois" ("client_id", "poi_rank" DESC, "predicted_visit_time" DESC);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS "mv_latest_client_trajectories" AS
+SELECT *
+FROM "view_latest_client_trajectories"
+WITH DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS "mv_latest_client_trajectories_id_idx" ON "mv_latest_client_trajectories" ("id");
+CREATE INDEX IF NOT EXISTS "mv_latest_client_trajectories_client_idx" ON "mv_latest_client_trajectories" ("client_id");
@@ -1,58 +1,56 @@
 import os
-import time
 import logging
-from typing import List, Dict, Any
-import psycopg
+from datetime import datetime
+from typing import List, Dict, Any, Optional
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Single shared connection
-_db = None
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
 
 
-def get_db_connection(retries: int = 5, delay: int = 5):
-    """Connect to Postgres with basic retry."""
-    global _db
-    if _db is not None and not _db.closed:
-        return _db
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
 
-    for attempt in range(1, retries + 1):
-        try:
-            _db = psycopg.connect(
-                dbname=os.getenv("POSTGRES_DB"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host=os.getenv("POSTGRES_HOST"),
-                port=os.getenv("POSTGRES_PORT", "5432"),
-                autocommit=True,
-                row_factory=dict_row,
-            )
-            logging.info("✅ producer/db: connected to PostgreSQL")
-            return _db
-        except psycopg.OperationalError as e:
-            logging.warning(f"⚠ DB connect attempt {attempt}/{retries} failed: {e}")
-            time.sleep(delay)
 
-    raise RuntimeError("❌ producer/db: failed to connect to PostgreSQL after retries")
-
-
-def load_from_db(query: str, params: tuple = ()) -> List[Dict[str, Any]]:
-    """Run a SELECT and return rows as list[dict]."""
+def load_from_db(query: str, params: tuple = (), prepare: Optional[bool] = None) -> List[Dict[str, Any]]:
+    """Run a SELECT and return rows as list[dict]. `prepare=True` keeps it as a server-side prepared statement."""
     try:
-        with get_db_connection().cursor() as cur:
-            cur.execute(query, params)
+        with db_conn() as conn, conn.cursor() as cur:
+            cur.execute(query, params, prepare=prepare)
             return cur.fetchall()
     except Exception as e:
         logging.error(f"❌ DB fetch failed: {e}")
         return []
 
 
-def fetch_optimized_route() -> List[Dict[str, Any]]:
+def fetch_optimized_route(since: Optional[datetime] = None) -> List[Dict[str, Any]]:
     """
     Return freshest unified routes; resolve session_id purely by time-window.
     Avoids dependency on 'current' geodata session which can filter valid rows.
+    `since` raises the 60s lower bound on created_at so polls skip rows already handed out.
+    Runs as a prepared statement: the UNION + LATERAL plan is built once per pooled connection.
     """
     query = """
         SELECT
@@ -80,7 +78,8 @@ def fetch_optimized_route() -> List[Dict[str, Any]]:
             ORDER BY s."start_time" DESC
             LIMIT 1
         ) AS s ON TRUE
-        WHERE r."created_at" >= NOW() - INTERVAL '60 seconds'
+        WHERE r."created_at" >= GREATEST(NOW() - INTERVAL '60 seconds', %s::timestamp)
         ORDER BY r."created_at" DESC;
     """
-    return load_from_db(query, ())
+    # GREATEST ignores NULL, so since=None keeps the plain 60s window
+    return load_from_db(query, (since,), prepare=True)
@@ -1,9 +1,11 @@
 # producer/producer_out.py (same changes apply to producer/db/db_connection.py if that's your runner)
 import os
-import json
+import orjson
 import time
 import logging
-from typing import Set, Tuple
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Tuple
 
 import paho.mqtt.client as mqtt
 from db.db_connection import fetch_optimized_route  # must return session_id now
@@ -19,7 +21,14 @@ RESULTS_TOPIC_TEMPLATE = (os.getenv(
     "results/client/{client_id}/session/{session_id}/"
 )).rstrip("/")
 
+# tolerate env templates that don't have {session_id}
+TOPIC_HAS_SESSION = "{session_id}" in RESULTS_TOPIC_TEMPLATE
+
+# QoS 1 messages allowed in flight at once, so a batch isn't throttled to paho's default of 20
+MAX_INFLIGHT = int(os.getenv("PRODUCER_MAX_INFLIGHT", "100"))
+
 client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+client.max_inflight_messages_set(MAX_INFLIGHT)
 
 
 def on_connect(client, userdata, flags, rc, properties=None):
@@ -42,32 +51,75 @@ client.on_connect = on_connect
 client.on_disconnect = on_disconnect
 client.connect(BROKER, PORT, keepalive=60)
 
-# dedupe key includes session_id
-_seen: Set[Tuple[str, int, str]] = set()
+# dedupe key includes session_id; bounded LRU so memory stays flat over long uptimes
+SEEN_MAX = int(os.getenv("PRODUCER_SEEN_MAX", "100000"))
+_seen: "OrderedDict[Tuple[str, int, int], None]" = OrderedDict()
+
+
+def already_published(key: Tuple[str, int, int]) -> bool:
+    """Record `key` as published; True if it was already seen. Oldest keys are evicted past SEEN_MAX."""
+    if key in _seen:
+        _seen.move_to_end(key)
+        return True
+    _seen[key] = None
+    if len(_seen) > SEEN_MAX:
+        _seen.popitem(last=False)
+    return False
+
+
+# topics per (client_id, session_id); bounded like _seen since sessions keep rolling over
+TOPIC_CACHE_MAX = int(os.getenv("PRODUCER_TOPIC_CACHE_MAX", "10000"))
+_topics: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+
+
+def topic_for(client_id: str, session_id: int) -> str:
+    """Results topic for a client/session, formatted once and then served from an LRU cache."""
+    key = (client_id, session_id)
+    topic = _topics.get(key)
+    if topic is not None:
+        _topics.move_to_end(key)
+        return topic
+    if TOPIC_HAS_SESSION:
+        topic = RESULTS_TOPIC_TEMPLATE.format(client_id=client_id, session_id=session_id)
+    else:
+        topic = RESULTS_TOPIC_TEMPLATE.format(client_id=client_id)
+    _topics[key] = topic
+    if len(_topics) > TOPIC_CACHE_MAX:
+        _topics.popitem(last=False)
+    return topic
+
+
+# Polls only ask for routes newer than the latest created_at seen, minus this lag so rows
+# committed late with an older created_at are still picked up (the dedupe set drops repeats)
+WATERMARK_LAG = timedelta(seconds=int(os.getenv("PRODUCER_WATERMARK_LAG_SECONDS", "10")))
 
 
 def publish_results(poll_seconds: int = 5):
     """Poll DB for fresh unified routes and publish to per-client+session topic."""
+    watermark = None
     while True:
-        rows = fetch_optimized_route()
+        rows = fetch_optimized_route(since=watermark - WATERMARK_LAG if watermark else None)
         if not rows:
             logging.info("⏳ No fresh routes to publish.")
         else:
+            # rows come newest first
+            newest = rows[0].get("created_at")
+            if newest and (watermark is None or newest > watermark):
+                watermark = newest
+
+            published = 0
             for r in rows:
                 client_id = str(r["client_id"])
                 session_id = int(r["session_id"])
-                created_at_iso = r["created_at"].isoformat() if r.get("created_at") else ""
-                key = (client_id, session_id, created_at_iso)
+                created_at = r.get("created_at")
+                # epoch microseconds: hashes cheaper than an ISO string and needs no formatting
+                created_at_us = int(created_at.timestamp() * 1_000_000) if created_at else 0
+                key = (client_id, session_id, created_at_us)
 
-                if key in _seen:
+                if already_published(key):
                     continue
-                _seen.add(key)
 
-                # tolerate env templates that don't have {session_id}
-                if "{session_id}" in RESULTS_TOPIC_TEMPLATE:
-                    topic = RESULTS_TOPIC_TEMPLATE.format(client_id=client_id, session_id=session_id)
-                else:
-                    topic = RESULTS_TOPIC_TEMPLATE.format(client_id=client_id)
+                topic = topic_for(client_id, session_id)
 
                 payload = {
                     "client_id": client_id,
@@ -78,16 +130,22 @@ def publish_results(poll_seconds: int = 5):
                         "lon": r.get("destination_lon"),
                     },
                     "route_path": r.get("path"),  # WKT LineString
-                    "timestamp": created_at_iso,
+                    "timestamp": created_at or "",  # orjson writes datetimes as ISO 8601
                 }
 
                 try:
                     # QoS 1 is a good default for results
-                    client.publish(topic, json.dumps(payload), qos=1, retain=True)
-                    logging.info(f"📤 Published → {topic}: {payload}")
+                    # orjson yields UTF-8 bytes, which paho publishes as-is
+                    client.publish(topic, orjson.dumps(payload), qos=1, retain=True)
+                    published += 1
+                    # payloads carry whole WKT paths: only format them when debugging
+                    logging.debug("📤 Published → %s: %s", topic, payload)
                 except Exception as e:
                     logging.error(f"❌ MQTT publish failed for {client_id}/{session_id}: {e}")
 
+            if published:
+                logging.info(f"📤 Published {published} route(s).")
+
         time.sleep(poll_seconds)
 
 
@@ -1,29 +1,31 @@
-import os, time, logging, psycopg
+import os
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
-_conn = None
 
+# Connection pool shared by every query in this service
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "8")),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
 
-def get_db(retries=5, delay=5):
-    global _conn
-    if _conn and not _conn.closed:
-        return _conn
-    for i in range(retries):
-        try:
-            _conn = psycopg.connect(
-                dbname=os.getenv("POSTGRES_DB"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host=os.getenv("POSTGRES_HOST"),
-                port=os.getenv("POSTGRES_PORT", "5432"),
-                autocommit=True,
-                row_factory=dict_row,
-            )
-            logging.info("✅ retention connected to PostgreSQL")
-            return _conn
-        except Exception as e:
-            logging.warning(f"⚠ DB connect attempt {i + 1}/{retries} failed: {e}")
-            time.sleep(delay)
-    raise RuntimeError("❌ retention: cannot connect to DB")
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
@@ -1,6 +1,6 @@
-import os, time, logging
+import os, time, logging, threading
 from datetime import timedelta
-from db.db_connection import get_db
+from db.db_connection import db_conn
 
 logging.basicConfig(level=logging.INFO)
 
@@ -8,6 +8,10 @@ logging.basicConfig(level=logging.INFO)
 TTL_DAYS = int(os.getenv("RETENTION_TTL_DAYS", "28"))
 BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "2000"))
 SLEEP_SECONDS = int(os.getenv("RETENTION_SLEEP_SECONDS", "5"))
+MATVIEW_REFRESH_SECONDS = int(os.getenv("RETENTION_MATVIEW_REFRESH_SECONDS", "30"))
+
+# Materialized views read every cycle by astar / future_pois
+MATVIEWS = ("mv_combined_pois", "mv_latest_client_trajectories")
 
 DELETE_SQL = f"""
 DELETE FROM trajectories t
@@ -21,31 +25,45 @@ USING (
 WHERE t.ctid = old.ctid;
 """
 
-COUNT_SQL = f"SELECT COUNT(*) AS n FROM trajectories WHERE created_at < NOW() - INTERVAL '{TTL_DAYS} days';"
+
+def refresh_matviews():
+    """Refresh each matview on its own, so one missing/broken view doesn't block the others."""
+    for view in MATVIEWS:
+        try:
+            with db_conn() as conn, conn.cursor() as cur:
+                cur.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY "{view}";')
+        except Exception as e:
+            logging.error(f"❌ matview refresh failed for {view}: {e}")
+
+
+def matview_loop():
+    """Own cadence and error handling: retention deletes never wait on, or fail with, a refresh."""
+    while True:
+        started = time.monotonic()
+        refresh_matviews()
+        time.sleep(max(0.0, MATVIEW_REFRESH_SECONDS - (time.monotonic() - started)))
 
 
 def main():
-    conn = get_db()
+    threading.Thread(target=matview_loop, name="matview-refresh", daemon=True).start()
+
     while True:
         try:
-            with conn.cursor() as cur:
-                cur.execute(COUNT_SQL)
-                n = cur.fetchone()["n"]
-            if n == 0:
-                time.sleep(SLEEP_SECONDS)
-                continue
-
-            # chew in small, lock-friendly chunks
-            total = 0
-            while True:
-                with conn.cursor() as cur:
-                    cur.execute(DELETE_SQL)
-                    deleted = cur.rowcount or 0
-                total += deleted
-                if deleted < BATCH_SIZE:
-                    break
-
-            logging.info(f"🧹 trajectories retention: deleted {total} rows (> {TTL_DAYS}d)")
+            # Borrow a connection per cycle; the pool replaces it if the server dropped it
+            with db_conn() as conn:
+                # chew in small, lock-friendly chunks; a short batch means nothing expired is left,
+                # so no separate COUNT(*) scan is needed to find out whether there is work
+                total = 0
+                while True:
+                    with conn.cursor() as cur:
+                        cur.execute(DELETE_SQL)
+                        deleted = cur.rowcount or 0
+                    total += deleted
+                    if deleted < BATCH_SIZE:
+                        break
+
+            if total:
+                logging.info(f"🧹 trajectories retention: deleted {total} rows (> {TTL_DAYS}d)")
             # short pause to let autovacuum breathe
             time.sleep(SLEEP_SECONDS)
         except Exception as e:
@@ -1,53 +1,51 @@
 import logging
-import time
 import os
-import psycopg
 import pandas as pd
 import geopandas as gpd
 from dotenv import load_dotenv
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
+import shapely
 from shapely import wkb, wkt
 import numpy as np
 from datetime import datetime
-from tensorflow import keras
-
-# cached model
-_lstm_model = None
-_lstm_loaded = False
-MODEL_PATH = "/app/saved_models/lstm_model.keras"
-MODEL_WEIGHTS = "/app/saved_models/lstm_model.weights.h5"
 
 load_dotenv()
-db_connection = None
-
 
-def get_db_connection(retries=5, delay=5):
-    global db_connection
-    if db_connection is not None and not db_connection.closed:
-        return db_connection
-
-    for attempt in range(retries):
-        try:
-            db_connection = psycopg.connect(
-                dbname=os.getenv('POSTGRES_DB'),
-                user=os.getenv('POSTGRES_USER'),
-                password=os.getenv('POSTGRES_PASSWORD'),
-                host=os.getenv('POSTGRES_HOST'),
-                port=os.getenv('POSTGRES_PORT', '5432'),
-                autocommit=True,
-                row_factory=dict_row
-            )
-            logging.info("✅ Connected to database.")
-            return db_connection
-        except psycopg.OperationalError as e:
-            logging.warning(f"⚠ DB connect attempt {attempt + 1} failed: {e}")
-            time.sleep(delay)
-    raise Exception("❌ Failed to connect to database after retries.")
+# Planner worker threads (see main.py); each holds at most one connection at a time
+ROUTING_WORKERS = int(os.getenv("ROUTING_WORKERS", "16"))
+# Connections beyond the planner workers, so the reroute loop never queues behind a busy planner
+POOL_HEADROOM = 2
+
+# Connection pool shared by every query in this service, sized to the planner workers plus headroom
+db_pool = ConnectionPool(
+    kwargs={
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": os.getenv("POSTGRES_HOST"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "autocommit": True,
+        "row_factory": dict_row,
+    },
+    min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "4")),
+    max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", str(ROUTING_WORKERS + POOL_HEADROOM))),
+    check=ConnectionPool.check_connection,  # evict dead connections on checkout
+    open=True,
+)
+
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection for the duration of the block."""
+    with db_pool.connection() as conn:
+        yield conn
 
 
 def load_from_db(query, params=None):
     try:
-        with get_db_connection().cursor() as cursor:
+        with db_conn() as conn, conn.cursor() as cursor:
             cursor.execute(query, params or ())
             return cursor.fetchall()
     except Exception as e:
@@ -57,7 +55,7 @@ def load_from_db(query, params=None):
 
 def save_to_db(query, params):
     try:
-        with get_db_connection().cursor() as cursor:
+        with db_conn() as conn, conn.cursor() as cursor:
             cursor.execute(query, params)
         logging.info("✅ DB write successful.")
     except Exception as e:
@@ -98,7 +96,7 @@ def fetch_daily_predicted_pois(client_id):
     if not result:
         return gpd.GeoDataFrame(columns=["lat", "lon", "timestamp", "geom"])
     df = pd.DataFrame(result)
-    df["geom"] = df["geom"].apply(lambda x: wkb.loads(x) if x else None)
+    df["geom"] = shapely.from_wkb(df["geom"].to_numpy(dtype=object))  # one vectorized decode, None stays None
     return gpd.GeoDataFrame(df, geometry="geom", crs="EPSG:4326")
 
 
@@ -180,7 +178,7 @@ def save_optimized_route(client_id, stop_id, destination_coords, path,
         origin_lat, origin_lon,
         created_at
     )
-    VALUES (%s, %s, %s, %s, ST_GeomFromText(%s, 4326), %s, %s, %s, %s, NOW())
+    VALUES (%s, %s, %s, %s, ST_GeomFromEWKB(%s), %s, %s, %s, %s, NOW())
     ON CONFLICT (client_id, stop_id, segment_type)
     DO UPDATE SET
         path = EXCLUDED.path,
@@ -196,7 +194,7 @@ def save_optimized_route(client_id, stop_id, destination_coords, path,
         stop_id,
         destination_coords[0],
         destination_coords[1],
-        path.wkt,
+        wkb.dumps(path, srid=4326),
         segment_type,
         is_chosen,
         origin_lat,
@@ -255,43 +253,42 @@ def get_route_usage_ratios(client_id):
     return astar_n / total, mapf_n / total
 
 
-def load_lstm_model():
-    global _lstm_model, _lstm_loaded
-    if _lstm_loaded and _lstm_model is not None:
-        return _lstm_model
-
-    try:
-        model = keras.models.load_model(MODEL_PATH)
-        # optional weights file (won't error if not present)
-        try:
-            model.load_weights(MODEL_WEIGHTS)
-        except Exception:
-            pass
-        _lstm_model = model
-        _lstm_loaded = True
-        logging.info("✅ LSTM model loaded in routing module.")
-    except Exception as e:
-        logging.warning(f"⚠️ Could not load LSTM model: {e}")
-        _lstm_model = None
-        _lstm_loaded = True
-
-    return _lstm_model
-
-
-def has_departure_candidate(client_id, stop_id):
+def fetch_reroute_batch(client_ids):
     """
-    True if there is at least one GTFS-RT departure that lines up with A* ETA
-    for this client & stop_id (per view_departure_candidates).
+    Everything the reroute tick needs for many clients, in one round trip:
+    latest location (older than 2s), latest chosen route and the best departure candidate for its stop.
+    Returns {client_id: row}; clients without a usable location are absent.
+    Route columns are NULL when the client has no chosen route, departure columns when no candidate exists.
     """
     query = """
-    SELECT 1
-    FROM view_departure_candidates
-    WHERE client_id = %s AND stop_id = %s
-    ORDER BY departure_time
-    LIMIT 1;
+    WITH latest_loc AS (
+        SELECT DISTINCT ON (client_id) client_id, lat, lon, updated_at
+        FROM geodata
+        WHERE client_id = ANY(%(clients)s)
+          AND updated_at <= NOW() - INTERVAL '2 seconds'
+        ORDER BY client_id, updated_at DESC
+    ),
+    latest_choice AS (
+        SELECT DISTINCT ON (client_id) client_id, segment_type, stop_id, ST_AsText(path) AS path, created_at
+        FROM optimized_routes
+        WHERE client_id = ANY(%(clients)s) AND is_chosen = TRUE
+        ORDER BY client_id, created_at DESC
+    ),
+    dep AS (
+        SELECT DISTINCT ON (v.client_id) v.client_id, v.departure_time, v.delay_seconds
+        FROM view_departure_candidates v
+        JOIN latest_choice c ON c.client_id = v.client_id AND c.stop_id = v.stop_id
+        ORDER BY v.client_id, COALESCE(v.delay_seconds, 0) ASC, v.departure_time ASC
+    )
+    SELECT l.client_id, l.lat, l.lon,
+           c.client_id IS NOT NULL AS has_choice, c.segment_type, c.stop_id, c.path, c.created_at,
+           d.client_id IS NOT NULL AS has_departure, d.departure_time, d.delay_seconds
+    FROM latest_loc l
+    LEFT JOIN latest_choice c ON c.client_id = l.client_id
+    LEFT JOIN dep d ON d.client_id = l.client_id;
     """
-    result = load_from_db(query, (client_id, stop_id))
-    return bool(result)
+    rows = load_from_db(query, {"clients": list(client_ids)})
+    return {row["client_id"]: row for row in rows or []}
 
 
 def fetch_best_departure_candidate(client_id, stop_id):
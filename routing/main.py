@@ -2,12 +2,14 @@ import logging
 import os
 import time
 import threading
+import math
 import random
 import signal
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Optional
 
-from db.db_connection import fetch_active_clients
-from selector import evaluate_and_store_best_route
+from db.db_connection import fetch_active_clients, ROUTING_WORKERS
+from selector import evaluate_and_store_best_route, warm_up_model
 import reroute  # uses reroute.loop_once()
 
 logging.basicConfig(level=logging.INFO)
@@ -18,9 +20,13 @@ INITIAL_WAIT = int(os.getenv("ROUTING_INITIAL_WAIT_SECONDS", "24"))
 PLANNER_SLEEP = int(os.getenv("ROUTING_PLANNER_SLEEP_SECONDS", "300"))   # 5 min
 REROUTE_TICK = int(os.getenv("ROUTING_REROUTE_TICK_SECONDS", "5"))       # 5 s
 JOIN_TIMEOUT = int(os.getenv("ROUTING_THREAD_JOIN_TIMEOUT", "15"))       # seconds
+WORKERS = ROUTING_WORKERS                                                # DB pool is sized from this
 
 _stop = threading.Event()
 
+# Persistent planner workers: concurrency (and DB connections) scale with WORKERS, not with client count
+EXECUTOR = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="planner-worker")
+
 
 def process_client(client_id: str):
     try:
@@ -43,15 +49,14 @@ def planner_loop():
                 _stop.wait(PLANNER_SLEEP)
                 continue
 
-            log.info(f"👥 Found {len(clients)} active clients. Launching threads.")
-            threads = []
-            for client_id in clients:
-                t = threading.Thread(target=process_client, args=(client_id,), daemon=True)
-                t.start()
-                threads.append(t)
+            log.info(f"👥 Found {len(clients)} active clients. Dispatching to {WORKERS} workers.")
+            futures = [EXECUTOR.submit(process_client, client_id) for client_id in clients]
 
-            for t in threads:
-                t.join(timeout=JOIN_TIMEOUT)
+            # each wave of WORKERS clients gets JOIN_TIMEOUT; stragglers keep running in the pool
+            deadline = JOIN_TIMEOUT * math.ceil(len(clients) / WORKERS)
+            _, not_done = wait(futures, timeout=deadline)
+            if not_done:
+                log.warning(f"⚠ {len(not_done)} client(s) still routing after {deadline}s; not waiting for them.")
 
             log.info(f"✅ Planner cycle complete. Sleeping {PLANNER_SLEEP}s.")
             _stop.wait(PLANNER_SLEEP)
@@ -85,6 +90,7 @@ def reroute_loop():
 def _handle_sigterm(*_):
     log.info("🫡 Received shutdown signal. Stopping loops...")
     _stop.set()
+    EXECUTOR.shutdown(wait=False, cancel_futures=True)
 
 
 def run_routing_engine():
@@ -92,6 +98,9 @@ def run_routing_engine():
     log.info(f"⏳ Waiting {INITIAL_WAIT}s for DB to stabilize...")
     _stop.wait(INITIAL_WAIT)
 
+    # Load + compile the model once before any planner thread needs it
+    warm_up_model()
+
     # Wire signals for graceful shutdown
     try:
         signal.signal(signal.SIGTERM, _handle_sigterm)
@@ -1,15 +1,35 @@
 import os
+import time
 import logging
+import threading
 import numpy as np
+import pandas as pd
 import joblib
+import tensorflow as tf
 from tensorflow import keras
+from db.db_connection import ROUTING_WORKERS
 
 MODEL_PATH = "/app/saved_models/lstm_model.keras"
 MODEL_WEIGHTS = "/app/saved_models/lstm_model.weights.h5"  # optional
 SCALER_PATH = "/app/saved_models/feature_scaler.joblib"
 FEATURES_PATH = "/app/saved_models/feature_columns.txt"
 
+# Compile the inference graph with XLA; set to 0 if a platform's XLA build misbehaves
+JIT_COMPILE = os.getenv("ROUTING_JIT_COMPILE", "1") == "1"
+
+# Concurrent planner threads' single-sample predictions are coalesced into one batched call:
+# the first caller of a batch waits this long for others to join, then runs it for everyone
+BATCH_WAIT_SECONDS = float(os.getenv("ROUTING_BATCH_WAIT_MS", "5")) / 1000.0
+
+# XLA compiles once per input shape, so coalesced batches are zero-padded up to a power-of-two
+# bucket (1, 2, 4, ... up to the planner worker count) and every bucket is compiled at warm-up
+BATCH_BUCKETS = tuple(1 << i for i in range(max(ROUTING_WORKERS - 1, 0).bit_length() + 1))
+
 _lstm_model = None
+_predict_fn = None
+_model_lock = threading.Lock()
+_pending = []
+_pending_lock = threading.Lock()
 _scaler = None
 _feature_order = None
 
@@ -25,9 +45,19 @@ def _load_feature_order(path=FEATURES_PATH):
 
 
 def _load_scaler(path=SCALER_PATH):
+    """
+    Load the training z-score statistics as {"mean", "std"} float32 arrays.
+    Older artifacts hold a fitted sklearn StandardScaler; its mean_/scale_ are used instead.
+    """
     if not os.path.exists(path):
         raise FileNotFoundError(f"Scaler not found: {path}")
-    return joblib.load(path)
+    scaler = joblib.load(path)
+    if not isinstance(scaler, dict):
+        scaler = {"mean": scaler.mean_, "std": scaler.scale_}
+    return {
+        "mean": np.asarray(scaler["mean"], dtype=np.float32),
+        "std": np.asarray(scaler["std"], dtype=np.float32),
+    }
 
 
 def _load_model():
@@ -41,15 +71,113 @@ def _load_model():
     return model
 
 
+def load_lstm_model():
+    """
+    The process-wide LSTM, loaded once (thread-safe) together with its compiled predict graph.
+    Returns None if the model can't be loaded, so callers can fall back to heuristics.
+    """
+    global _lstm_model, _predict_fn
+    if _lstm_model is None:
+        with _model_lock:
+            if _lstm_model is None:
+                try:
+                    model = _load_model()
+                except Exception as e:
+                    logging.warning(f"⚠️ Could not load LSTM model: {e}")
+                    return None
+                # one traced graph instead of model.predict's per-call dataset/loop setup
+                _predict_fn = tf.function(model, jit_compile=JIT_COMPILE, reduce_retracing=True)
+                _lstm_model = model
+                logging.info("✅ LSTM model loaded for inference.")
+    return _lstm_model
+
+
+def predict(batch):
+    """Run the loaded model on a (batch, T, F) array through the compiled graph; returns a NumPy array."""
+    if load_lstm_model() is None:
+        raise RuntimeError("LSTM model not available")
+    return _predict_fn(tf.convert_to_tensor(batch, dtype=tf.float32), training=False).numpy()
+
+
+class _PendingPrediction:
+    __slots__ = ("sample", "done", "result", "error")
+
+    def __init__(self, sample):
+        self.sample = sample
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _predict_bucketed(samples):
+    """Predict (N, T, F) samples as padded bucket-sized calls, so only warmed-up shapes reach XLA."""
+    largest = BATCH_BUCKETS[-1]
+    outputs = []
+    for start in range(0, len(samples), largest):
+        chunk = samples[start:start + largest]
+        size = next(bucket for bucket in BATCH_BUCKETS if bucket >= len(chunk))
+        if size > len(chunk):
+            chunk = np.concatenate([chunk, np.zeros((size - len(chunk),) + chunk.shape[1:], dtype=chunk.dtype)])
+        outputs.append(predict(chunk)[:min(largest, len(samples) - start)])
+    return np.concatenate(outputs)
+
+
+def warm_up(sample_shape):
+    """Compile the predict graph for every batch bucket of (T, F) = sample_shape."""
+    for size in BATCH_BUCKETS:
+        predict(np.zeros((size,) + tuple(sample_shape), dtype=np.float32))
+
+
+def _run_batch(batch):
+    """Stack same-shaped samples, predict each group in one call and hand every caller its row."""
+    groups = {}
+    for item in batch:
+        groups.setdefault(item.sample.shape, []).append(item)
+    for items in groups.values():
+        try:
+            out = _predict_bucketed(np.stack([item.sample for item in items]))
+            for item, row in zip(items, out):
+                item.result = row
+        except Exception as e:
+            for item in items:
+                item.error = e
+    for item in batch:
+        item.done.set()
+
+
+def predict_one(sample):
+    """
+    Predict a single (T, F) sample, batched with whatever other threads submit at the same time.
+    Returns the model output row for this sample.
+    """
+    item = _PendingPrediction(np.asarray(sample, dtype=np.float32))
+    with _pending_lock:
+        _pending.append(item)
+        leader = len(_pending) == 1
+
+    if leader:
+        time.sleep(BATCH_WAIT_SECONDS)
+        with _pending_lock:
+            batch = _pending[:]
+            _pending.clear()
+        if len(batch) > 1:
+            logging.debug(f"LSTM batch of {len(batch)} predictions")
+        _run_batch(batch)
+
+    item.done.wait()
+    if item.error is not None:
+        raise item.error
+    return item.result
+
+
 def init_runtime():
     """
     Lazily initialize model, scaler, and feature order.
     Safe to call multiple times; caches globals.
     """
-    global _lstm_model, _scaler, _feature_order
-    if _lstm_model is None:
-        _lstm_model = _load_model()
-        logging.info("✅ LSTM model loaded for inference.")
+    global _scaler, _feature_order
+    if load_lstm_model() is None:
+        raise RuntimeError("LSTM model not available")
     if _scaler is None:
         _scaler = _load_scaler()
         logging.info("✅ Scaler loaded for inference.")
@@ -91,20 +219,14 @@ def make_sequence(feature_rows, timesteps):
 
     model, scaler, feature_order = get_runtime()
 
-    # assemble matrix (timesteps, F) in saved feature order
-    mat = np.zeros((timesteps, len(feature_order)), dtype=np.float32)
-    for i, r in enumerate(rows):
-        for j, col in enumerate(feature_order):
-            try:
-                mat[i, j] = float(r.get(col, 0.0))
-            except Exception:
-                mat[i, j] = 0.0
-
-    # scale with the training scaler
-    # StandardScaler expects 2D -> reshape, transform, back
-    flat = mat.reshape(-1, len(feature_order))
-    flat_scaled = scaler.transform(flat)
-    mat_scaled = flat_scaled.reshape(timesteps, len(feature_order))
+    # assemble matrix (timesteps, F) in saved feature order, column-wise:
+    # missing features and values that aren't float-castable become 0.0
+    frame = pd.DataFrame.from_records(rows).reindex(columns=feature_order)
+    mat = (frame.apply(pd.to_numeric, errors="coerce")
+           .to_numpy(dtype=np.float32, na_value=0.0))
+
+    # scale with the training statistics (broadcast over the feature axis)
+    mat_scaled = (mat - scaler["mean"]) / scaler["std"]
 
     # add batch dimension
     return np.expand_dims(mat_scaled, axis=0)  # (1, T, F)
@@ -120,9 +242,8 @@ def predict_sequence(feature_rows, timesteps=60):
     this returns the *scaled* lat/lon. If you want to inverse‑transform them to real degrees,
     use `invert_latlon()` below.
     """
-    model, _, _ = get_runtime()
     seq = make_sequence(feature_rows, timesteps)
-    preds = model.predict(seq, verbose=0)  # shape (1, 2) for your current model
+    preds = predict(seq)  # shape (1, 2) for your current model
     return preds[0]
 
 
@@ -132,7 +253,7 @@ def invert_latlon(scaled_lat, scaled_lon):
 
     This works by constructing a dummy 1xF vector filled with zeros and placing
     the scaled lat/lon in the last two positions (because training put labels
-    at the end of the feature list), then applying scaler.inverse_transform
+    at the end of the feature list), then undoing the z-score
     and reading back those last two values.
 
     Returns (lat_deg, lon_deg)
@@ -142,5 +263,5 @@ def invert_latlon(scaled_lat, scaled_lon):
     dummy = np.zeros((1, F), dtype=np.float32)
     dummy[0, F - 2] = scaled_lat
     dummy[0, F - 1] = scaled_lon
-    inv = scaler.inverse_transform(dummy)
+    inv = dummy * scaler["std"] + scaler["mean"]
     return float(inv[0, F - 2]), float(inv[0, F - 1])
@@ -2,8 +2,11 @@ import os
 import time
 import logging
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
+import shapely
 from shapely.geometry import Point, LineString
 from shapely import wkt
 from pyproj import Transformer
@@ -11,8 +14,8 @@ from pyproj import Transformer
 from db.db_connection import (
     load_from_db,
     fetch_active_clients,
-    fetch_latest_location,
-    has_departure_candidate, save_reroute,
+    fetch_reroute_batch,
+    save_reroute,
 )
 from selector import evaluate_and_store_best_route
 
@@ -30,70 +33,56 @@ DEPARTURE_STALE_SECONDS = 45  # if departure already passed this much, reroute
 # metric projection (fast + fine for city scale)
 _transformer = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
 
+# projected paths kept across ticks: a chosen path is checked every tick until it changes
+PROJECTED_PATH_CACHE_SIZE = int(os.getenv("ROUTING_PROJECTED_PATH_CACHE_SIZE", "1024"))
+
 # in-memory debounce per client (stateless across restarts; safe)
 _off_counts = {}  # client_id -> consecutive_off_path_count
 
 
-def _meters_point_to_linestring(lat, lon, line_wkt):
-    """Compute point-to-line closest distance in meters (projecting to EPSG:3857)."""
-    if not line_wkt:
-        return float("inf")
+@lru_cache(maxsize=PROJECTED_PATH_CACHE_SIZE)
+def _project_linestring(line_wkt):
+    """Parse a WKT path and project it to EPSG:3857 in one array transform; None if unusable."""
     try:
         line = wkt.loads(line_wkt)
         if not isinstance(line, LineString) or line.is_empty:
-            return float("inf")
+            return None
     except Exception:
+        return None
+
+    coords = shapely.get_coordinates(line)
+    xs, ys = _transformer.transform(coords[:, 0], coords[:, 1])
+    return shapely.linestrings(np.column_stack((xs, ys)))
+
+
+def _meters_point_to_linestring(lat, lon, line_wkt):
+    """Compute point-to-line closest distance in meters (projecting to EPSG:3857)."""
+    if not line_wkt:
+        return float("inf")
+    line_m = _project_linestring(line_wkt)
+    if line_m is None:
         return float("inf")
 
     x, y = _transformer.transform(lon, lat)
-    px = Point(x, y)
-    # project full line to metric once for speed
-    xs, ys = zip(*[_transformer.transform(pt[0], pt[1]) for pt in line.coords])
-    line_m = LineString(list(zip(xs, ys)))
-    return px.distance(line_m)  # meters in EPSG:3857
+    return Point(x, y).distance(line_m)  # meters in EPSG:3857
 
 
-def _fetch_current_choice(client_id):
+def _choice_from_batch(row):
     """
-    Get latest chosen route for client from optimized_routes.
+    Latest chosen route from a fetch_reroute_batch row.
     Returns dict or None:
       { segment_type, stop_id, created_at (UTC), path_wkt }
     """
-    q = """
-        SELECT segment_type, stop_id, ST_AsText(path) AS path, created_at
-        FROM optimized_routes
-        WHERE client_id = %s AND is_chosen = TRUE
-        ORDER BY created_at DESC
-        LIMIT 1;
-    """
-    rows = load_from_db(q, (client_id,))
-    if not rows:
+    if not row["has_choice"]:
         return None
-    r = rows[0]
     return {
-        "segment_type": (r.get("segment_type") or "").lower(),
-        "stop_id": r.get("stop_id"),
-        "path_wkt": r.get("path"),
-        "created_at": r.get("created_at"),
+        "segment_type": (row.get("segment_type") or "").lower(),
+        "stop_id": row.get("stop_id"),
+        "path_wkt": row.get("path"),
+        "created_at": row.get("created_at"),
     }
 
 
-def _latest_departure_snapshot(client_id, stop_id):
-    """
-    Peek at the current best departure for this stop from view_departure_candidates.
-    Returns dict or None.
-    """
-    q = """
-        SELECT departure_time, delay_seconds, status, route_id, trip_id
-        FROM view_departure_candidates
-        WHERE client_id = %s AND stop_id = %s
-        ORDER BY COALESCE(delay_seconds, 0) ASC, departure_time ASC
-        LIMIT 1;
-    """
-    rows = load_from_db(q, (client_id, stop_id))
-    return rows[0] if rows else None
-
-
 def _needs_reroute_for_deviation(client_id, choice, lat, lon):
     """
     Check geometric deviation from advised path.
@@ -117,27 +106,22 @@ def _needs_reroute_for_deviation(client_id, choice, lat, lon):
     return False, ""
 
 
-def _needs_reroute_for_gtfs(client_id, choice):
+def _needs_reroute_for_gtfs(choice, dep):
     """
     For MAPF choices, verify there’s still a viable departure aligned with ETA.
+    `dep` is the best departure candidate for the chosen stop (fetch_reroute_batch row), or None.
     Returns (bool, reason_str)
     """
     if not choice or choice["segment_type"] != "multimodal":
         return False, ""
 
-    stop_id = choice["stop_id"]
-    if not stop_id:
+    if not choice["stop_id"]:
         return True, "missing_stop_id"
 
-    # Quick availability check (fast path)
-    if not has_departure_candidate(client_id, stop_id):
-        return True, "no_departure_candidate"
-
-    # Deeper check: delay or passed departure
-    dep = _latest_departure_snapshot(client_id, stop_id)
     if not dep:
-        return True, "no_departure_row"
+        return True, "no_departure_candidate"
 
+    # Delay or passed departure
     dep_time = dep.get("departure_time")
     delay = float(dep.get("delay_seconds") or 0.0)
     now = datetime.now(timezone.utc)
@@ -201,14 +185,16 @@ def loop_once():
     if not clients:
         return
 
-    for client_id in clients:
-        choice = _fetch_current_choice(client_id)
+    # one round trip for every client's location, chosen route and departure candidate
+    batch = fetch_reroute_batch(clients)
 
+    for client_id in clients:
         # latest location (we already debounce in deviation check)
-        loc = fetch_latest_location(client_id)
-        if not loc:
+        row = batch.get(client_id)
+        if not row:
             continue
-        lat, lon, _ = loc
+        lat, lon = row["lat"], row["lon"]
+        choice = _choice_from_batch(row)
 
         # 1) Deviation?
         need_dev, why_dev = _needs_reroute_for_deviation(client_id, choice, lat, lon)
@@ -217,7 +203,7 @@ def loop_once():
             continue  # after reroute we’ll check again next tick
 
         # 2) GTFS-RT shift (only for MAPF)
-        need_gtfs, why_gtfs = _needs_reroute_for_gtfs(client_id, choice)
+        need_gtfs, why_gtfs = _needs_reroute_for_gtfs(choice, row if row["has_departure"] else None)
         if need_gtfs:
             _reroute_client(client_id, why_gtfs)
             continue
@@ -12,8 +12,8 @@ from db.db_connection import (
     save_to_db,
     get_latest_speed,
     get_route_usage_ratios,  # returns (astar_ratio, mapf_ratio)
-    load_lstm_model,
 )
+from ml_inference import load_lstm_model, predict_one, warm_up
 
 logging.basicConfig(level=logging.INFO)
 
@@ -53,10 +53,9 @@ def _predict_with_lstm(astar_feat, mapf_feat):
     if model is None:
         raise RuntimeError("LSTM model not available")
 
-    # model expects (batch, timesteps, features)
+    # model expects (batch, timesteps, features); the batch is shared with concurrent planner threads
     seq = np.stack([astar_feat, mapf_feat], axis=0)  # (2, F)
-    seq = np.expand_dims(seq, axis=0)               # (1, 2, F)
-    preds = model.predict(seq, verbose=0)
+    preds = predict_one(seq)
 
     arr = np.array(preds).squeeze()
     if arr.ndim == 1 and arr.shape[0] == 2:
@@ -71,6 +70,20 @@ def _predict_with_lstm(astar_feat, mapf_feat):
     return ("mapf" if score_mapf > score_astar else "astar", [score_astar, score_mapf])
 
 
+def warm_up_model():
+    """
+    Load the LSTM and compile it for every batch bucket of a (2 candidates, 6 features) sequence,
+    so graph tracing and XLA compilation happen at startup instead of on live routes.
+    """
+    try:
+        if load_lstm_model() is None:
+            raise RuntimeError("LSTM model not available")
+        warm_up((2, 6))
+        logging.info("✅ LSTM warmed up.")
+    except Exception as e:
+        logging.warning(f"⚠️ LSTM warm-up skipped: {e}")
+
+
 def _fetch_best_departure_candidate(client_id, stop_id):
     """
     Pick the best departure aligned with predicted_eta: